@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'LibraryManagement.settings')
 
 application = get_asgi_application()
+
+# Async views may run their independent queries on the server's thread pool
+from library import concurrency  # noqa: E402
+
+concurrency.serving_asgi = True
@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'library.middleware.RequestMetricsMiddleware',
+    'library.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,6 +65,9 @@ TEMPLATES = [
         'APP_DIRS': True,
         'OPTIONS': {
             'environment': 'library.jinja2.environment',
+            'context_processors': [
+                'django.contrib.messages.context_processors.messages',
+            ],
         },
     },
     {
@@ -94,9 +99,55 @@ DATABASES = {
         'PASSWORD': '',
         'HOST': 'localhost',
         'PORT': '3306',
+        # Keep connections open between requests, checking them before reuse
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # A read replica; list it in LIBRARY_READ_REPLICAS as well. The test
+    # runner points it at the test database instead of creating its own.
+    # 'replica1': {
+    #     'ENGINE': 'django.db.backends.mysql',
+    #     'NAME': 'library_db',
+    #     'USER': 'library_ro',
+    #     'PASSWORD': '',
+    #     'HOST': 'replica1.internal',
+    #     'PORT': '3306',
+    #     'CONN_MAX_AGE': 60,
+    #     'CONN_HEALTH_CHECKS': True,
+    #     'TEST': {'MIRROR': 'default'},
+    # },
+}
+
+# Read-only views (marked with library.routers.replica_reads) read from one
+# of these aliases; a browser that has just written reads from `default` for
+# LIBRARY_REPLICA_STICKY_SECONDS, and an unreachable replica is skipped for
+# LIBRARY_REPLICA_RETRY_SECONDS. See LibraryManagement/settings_replicas.py
+# for a local setup on SQLite.
+DATABASE_ROUTERS = ['library.routers.ReplicaRouter']
+LIBRARY_READ_REPLICAS = []
+LIBRARY_REPLICA_STICKY_SECONDS = 10
+LIBRARY_REPLICA_RETRY_SECONDS = 30
+
+# Caching
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# The local-memory backend is a per-process LRU, fine for development and a
+# single worker. Point this at Redis or Memcached when running several.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'library',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 
+# Cache alias holding the dashboard statistics, see library/stats.py
+LIBRARY_STATS_CACHE = 'default'
+# Rendered template fragments, see {% cache %} in library/jinja2.py
+LIBRARY_FRAGMENT_CACHE = 'default'
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -143,3 +194,49 @@ INTERNAL_IPS = [
     "127.0.0.1",
     # ...
 ]
+
+# Full-text search backend, see library/fulltext.py. When unset the backend
+# matching the database vendor is used (FTS5 on SQLite, FULLTEXT on MySQL).
+# LIBRARY_SEARCH_BACKEND = 'library.fulltext.MySQLFulltextBackend'
+
+# Search box suggestions come from an in-memory index in each worker, see
+# library/autocomplete.py. Changes made by other workers show up within
+# this many seconds.
+LIBRARY_AUTOCOMPLETE_RECHECK_SECONDS = 30
+
+# Overdue fines, see library/fines.py
+LIBRARY_FINE_PER_DAY = '0.25'
+LIBRARY_FINE_CAP = '25.00'
+# Members owing more than this cannot borrow; None lifts the limit
+LIBRARY_FINE_BLOCK_BALANCE = '10.00'
+
+# Holds, see library/circulation.py. A copy set aside for a hold waits this
+# many days for the member before going to the next hold.
+LIBRARY_HOLD_PICKUP_DAYS = 7
+
+# Background tasks, see library/tasks.py. `manage.py run_tasks` runs this
+# many at a time. A task still running after the lease is assumed lost and
+# is queued again.
+LIBRARY_TASK_WORKERS = 4
+LIBRARY_TASK_LEASE_SECONDS = 600
+
+# Due-date reminders, see library/reminders.py. Members are emailed about
+# loans due within this many days, this many emails per batch.
+LIBRARY_REMINDER_DAYS = 2
+LIBRARY_REMINDER_BATCH = 100
+DEFAULT_FROM_EMAIL = 'library@localhost'
+
+# Compiled Jinja2 templates, shared by every worker and filled at build time
+# by `manage.py precompile_templates`. Set LIBRARY_TEMPLATE_BYTECODE_CACHE to
+# a cache alias to share them through the cache instead.
+LIBRARY_TEMPLATE_BYTECODE_DIR = BASE_DIR / '.jinja2_cache'
+# LIBRARY_TEMPLATE_BYTECODE_CACHE = 'default'
+
+# Mixed into page ETags; change it on deploys that alter templates
+LIBRARY_RELEASE = ''
+
+# Under asgi.py, async views (dashboard, member detail) run their independent
+# queries at the same time, each on its own connection of a long-lived thread
+# pool; see library/concurrency.py. Under WSGI they always run in turn on the
+# request's connection. Keep a CONN_MAX_AGE so the pool threads reuse theirs.
+LIBRARY_CONCURRENT_QUERIES = True
@@ -0,0 +1,31 @@
+"""Local settings with two SQLite "replicas" of an SQLite primary.
+
+The replicas are extra connections to the primary's file, so they are never
+behind, but every query shows which alias it ran on (for instance in the
+debug toolbar's SQL panel)::
+
+    DJANGO_SETTINGS_MODULE=LibraryManagement.settings_replicas python manage.py migrate
+    DJANGO_SETTINGS_MODULE=LibraryManagement.settings_replicas python manage.py runserver
+
+The test suite runs itself under these settings too (``ReplicaSettingsTests``).
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+
+def sqlite(**extra):
+    return dict(
+        ENGINE='django.db.backends.sqlite3',
+        NAME=BASE_DIR / 'db.sqlite3',
+        CONN_MAX_AGE=60,
+        CONN_HEALTH_CHECKS=True,
+        **extra
+    )
+
+
+DATABASES = {
+    'default': sqlite(),
+    'replica1': sqlite(TEST={'MIRROR': 'default'}),
+    'replica2': sqlite(TEST={'MIRROR': 'default'}),
+}
+LIBRARY_READ_REPLICAS = ['replica1', 'replica2']
@@ -0,0 +1,273 @@
+"""JSON API for the catalog and circulation.
+
+Every resource supports::
+
+    GET   /api/<resource>/?after=<cursor>&limit=50&fields=id,title
+    POST  /api/<resource>/
+    GET   /api/<resource>/<pk>/?fields=...
+    PATCH /api/<resource>/<pk>/
+
+Lists are keyset paginated (see ``library.pagination``) and streamed: rows
+are read with ``QuerySet.iterator`` and written out one at a time, with the
+``next`` cursor at the end of the document. Books and members also take
+``q``, which lists every match in relevance order instead. ``fields`` limits the output to
+the named fields, and joins or prefetches are only added for fields that
+need them.
+
+Writes are validated by the same forms as the HTML views. Loans are created
+through ``circulation.issue_loan`` (book by ISBN, as at the desk) and
+returned with ``PATCH {"returned": true}``. Clients must send
+``Content-Type: application/json``; browsers cannot send that cross-site
+without a preflight, so these views skip the CSRF cookie check.
+"""
+import json
+from operator import attrgetter
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.forms.models import model_to_dict
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from . import circulation, fulltext
+from .forms import AuthorForm, BookForm, CategoryForm, LoanIssueForm, MemberForm
+from .models import Author, Book, Category, Loan, Member
+from .pagination import InvalidCursor, KeysetPaginator
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 1000
+
+
+class Field:
+    def __init__(self, get, select=(), prefetch=()):
+        self.get = get
+        self.select = select
+        self.prefetch = prefetch
+
+
+def columns(*names):
+    return {name: Field(attrgetter(name)) for name in names}
+
+
+class Resource:
+    def __init__(self, model, ordering, fields, form=None, search=False, filters=None):
+        self.model = model
+        self.ordering = ordering
+        self.fields = fields
+        self.form = form
+        self.search = search
+        # GET parameter -> function(queryset, value) narrowing the list
+        self.filters = filters or {}
+
+    def queryset(self, names):
+        queryset = self.model.objects.all()
+        select = {name for field in names for name in self.fields[field].select}
+        prefetch = {name for field in names for name in self.fields[field].prefetch}
+        if select:
+            queryset = queryset.select_related(*sorted(select))
+        if prefetch:
+            queryset = queryset.prefetch_related(*sorted(prefetch))
+        return queryset
+
+    def serialize(self, obj, names):
+        return {name: self.fields[name].get(obj) for name in names}
+
+
+def by_id(param, lookup):
+    """Filter on ``lookup`` equal to the integer given in ``param``"""
+    def narrow(queryset, value):
+        try:
+            pk = int(value)
+        except ValueError:
+            raise BadRequest(f'{param} must be an integer id')
+        return queryset.filter(**{lookup: pk})
+    return narrow
+
+
+def open_loans(queryset, value):
+    return queryset.filter(return_date__isnull=value.lower() in ('1', 'true'))
+
+
+def overdue_loans(queryset, value):
+    if value.lower() not in ('1', 'true'):
+        return queryset
+    return queryset.filter(return_date__isnull=True, due_date__lt=timezone.localdate())
+
+
+RESOURCES = {
+    'books': Resource(
+        Book, ('title', 'id'),
+        dict(
+            columns('id', 'title', 'slug', 'isbn', 'publisher', 'published_date', 'total_copies', 'available_copies'),
+            author=Field(lambda book: {'id': book.author_id, 'name': book.author.name}, select=('author',)),
+            categories=Field(
+                lambda book: [{'id': category.pk, 'name': category.name} for category in book.category.all()],
+                prefetch=('category',),
+            ),
+        ),
+        form=BookForm, search=True,
+        filters={'category': by_id('category', 'category__id')},
+    ),
+    'authors': Resource(Author, ('name', 'id'), columns('id', 'name', 'biography'), form=AuthorForm),
+    'categories': Resource(Category, ('name', 'id'), columns('id', 'name'), form=CategoryForm),
+    'members': Resource(
+        Member, ('last_name', 'first_name', 'id'),
+        columns(
+            'id', 'first_name', 'last_name', 'email', 'phone_number', 'address', 'join_date',
+            'active_loan_count', 'total_loan_count', 'fine_balance',
+        ),
+        form=MemberForm, search=True,
+    ),
+    'loans': Resource(
+        Loan, ('-issue_date', '-id'),
+        dict(
+            columns('id', 'issue_date', 'due_date', 'return_date'),
+            book=Field(lambda loan: {'id': loan.book_id, 'title': loan.book.title, 'isbn': loan.book.isbn}, select=('book',)),
+            member=Field(lambda loan: {'id': loan.member_id, 'name': str(loan.member)}, select=('member',)),
+        ),
+        filters={
+            'member': by_id('member', 'member_id'),
+            'book': by_id('book', 'book_id'),
+            'open': open_loans,
+            'overdue': overdue_loans,
+        },
+    ),
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def error(message, status=400, **extra):
+    return JsonResponse(dict(error=message, **extra), status=status)
+
+
+def selected_fields(request, resource):
+    fields = request.GET.get('fields')
+    if not fields:
+        return list(resource.fields)
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in resource.fields]
+    if unknown:
+        raise BadRequest('Unknown fields: ' + ', '.join(unknown))
+    return names
+
+
+def read_body(request):
+    if request.content_type != 'application/json':
+        raise BadRequest('Content-Type must be application/json')
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        raise BadRequest('Request body is not valid JSON')
+    if not isinstance(data, dict):
+        raise BadRequest('Request body must be a JSON object')
+    return data
+
+
+def form_data(form_class, instance):
+    """Current values of ``instance`` in the shape the form expects as input"""
+    data = model_to_dict(instance, fields=form_class._meta.fields)
+    for name, value in data.items():
+        if isinstance(value, list):
+            data[name] = [getattr(item, 'pk', item) for item in value]
+    return data
+
+
+def stream_list(resource, rows, names):
+    yield '{"results":['
+    for i, obj in enumerate(rows):
+        yield (',' if i else '') + json.dumps(resource.serialize(obj, names), cls=DjangoJSONEncoder)
+    yield '],"next":%s}' % json.dumps(rows.next_cursor)
+
+
+def list_objects(request, resource):
+    names = selected_fields(request, resource)
+    queryset = resource.queryset(names)
+    for param, narrow in resource.filters.items():
+        value = request.GET.get(param)
+        if value:
+            queryset = narrow(queryset, value)
+    try:
+        limit = min(max(int(request.GET.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        raise BadRequest('limit must be an integer')
+    query = request.GET.get('q')
+    try:
+        if query and resource.search:
+            # Best matches first, with cursors into the ranked results
+            rows = fulltext.search_page(queryset, query, after=request.GET.get('after'), per_page=limit)
+        else:
+            rows = KeysetPaginator(queryset, resource.ordering, per_page=limit).stream(after=request.GET.get('after'))
+    except InvalidCursor:
+        raise BadRequest('Invalid cursor')
+    return StreamingHttpResponse(stream_list(resource, rows, names), content_type='application/json')
+
+
+def detail(resource, pk, names, status=200):
+    obj = get_object_or_404(resource.queryset(names), pk=pk)
+    return JsonResponse(resource.serialize(obj, names), encoder=DjangoJSONEncoder, status=status)
+
+
+def save_form(resource, data, instance=None):
+    form = resource.form(data, instance=instance)
+    if not form.is_valid():
+        return None, error('Validation failed', errors=form.errors.get_json_data())
+    return form.save(), None
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+def collection(request, resource):
+    resource = RESOURCES[resource]
+    try:
+        if request.method == 'GET':
+            return list_objects(request, resource)
+        data = read_body(request)
+    except BadRequest as e:
+        return error(str(e))
+
+    if resource.model is Loan:
+        form = LoanIssueForm(data)
+        if not form.is_valid():
+            return error('Validation failed', errors=form.errors.get_json_data())
+        try:
+            obj = circulation.issue_loan(form.cleaned_data['book'], form.cleaned_data['member'], form.cleaned_data['due_date'])
+        except circulation.CirculationError as e:
+            return error(str(e), status=409)
+    else:
+        obj, response = save_form(resource, data)
+        if response:
+            return response
+    return detail(resource, obj.pk, list(resource.fields), status=201)
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'PATCH'])
+def item(request, resource, pk):
+    resource = RESOURCES[resource]
+    try:
+        names = selected_fields(request, resource)
+        if request.method == 'GET':
+            return detail(resource, pk, names)
+        data = read_body(request)
+    except BadRequest as e:
+        return error(str(e))
+
+    obj = get_object_or_404(resource.model, pk=pk)
+    if resource.model is Loan:
+        if data != {'returned': True}:
+            return error('Loans only accept {"returned": true}')
+        try:
+            circulation.return_loan(obj)
+        except circulation.CirculationError as e:
+            return error(str(e), status=409)
+    else:
+        # PATCH only sends the changed fields; the form validates the whole row
+        _, response = save_form(resource, dict(form_data(resource.form, obj), **data), instance=obj)
+        if response:
+            return response
+    return detail(resource, pk, names)
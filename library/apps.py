@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class LibraryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'library'
+
+    def ready(self):
+        from . import circulation, reminders, signals  # noqa: F401
@@ -0,0 +1,226 @@
+"""Search-as-you-type suggestions from an in-process prefix index.
+
+Every word of a book title or author name starts a key, so "hand" finds
+"The Left Hand of Darkness", and each ISBN is a key with any hyphens
+removed. The keys live in one sorted list with a parallel list of the
+entries they belong to. A lookup is a ``bisect`` to the first key with
+the typed prefix, followed by a scan that stops after ``limit`` entries.
+It never queries the database.
+
+The index is built on first use from two ``values_list`` queries. Signal
+handlers in ``library.signals`` apply this process's book and author
+writes once they commit. Writes from other processes move the ``book`` and
+``author`` version counters (see ``library.versions``) further than this
+process's own bumps account for. The counters are read at most once every
+``LIBRARY_AUTOCOMPLETE_RECHECK_SECONDS``. When they show such writes, the
+index is rebuilt in a background thread while lookups keep using the old
+one. Bulk writers that skip signals clear the index instead.
+"""
+import bisect
+import re
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+from django.db import connection
+
+from . import versions
+from .models import Author, Book
+
+# Version counters that cover everything in the index
+VERSION_KEYS = ('author', 'book')
+ISBN_QUERY = re.compile(r'[0-9Xx][0-9Xx -]*')
+
+
+def normalize(text):
+    """Lower case, without accents or punctuation, words separated by one space"""
+    text = text.casefold()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.sub(r'\W+', ' ', text).split())
+
+
+def normalize_isbn(text):
+    return re.sub(r'[^0-9x]', '', text.casefold())
+
+
+def word_starts(text):
+    """``text`` normalized, and each of its tails that begins a word"""
+    words = normalize(text).split()
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+def snapshot():
+    """The VERSION_KEYS counters, and how many of their bumps this process made"""
+    # Our own bumps first: one landing in between then looks like another
+    # process's write, which costs a rebuild rather than a missed change
+    own = versions.bumped_here(VERSION_KEYS)
+    current = versions.fetch(VERSION_KEYS)
+    return tuple(current.get(key, (0, None))[0] for key in VERSION_KEYS), own
+
+
+def elsewhere(version):
+    """Counters less this process's bumps, which its signal handlers have applied"""
+    current, own = version
+    return tuple(count - mine for count, mine in zip(current, own))
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Held while the index is being built, so only one build runs
+        self.build_lock = threading.Lock()
+        self.keys = []
+        self.refs = []  # (kind, pk) of the entry each key belongs to
+        self.books = {}  # pk -> (title, slug, author_id, isbn)
+        self.authors = {}  # pk -> name
+        self.version = None  # snapshot() the index was built at
+        self.checked = 0.0
+        # Writes applied while a build runs, replayed onto the new index
+        self.pending = None
+        self.builder = None  # the last background rebuild thread
+
+    def records(self, kind):
+        return self.books if kind == 'book' else self.authors
+
+    def keys_for(self, kind, record):
+        if kind == 'book':
+            title, _, _, isbn = record
+            return word_starts(title) + [normalize_isbn(isbn)]
+        return word_starts(record)
+
+    def load(self):
+        """Rebuild the whole index from the database"""
+        with self.lock:
+            self.pending = []
+        try:
+            # Read the counters first, so a write racing the build triggers another one
+            version = snapshot()
+            books = {
+                pk: (title, slug, author_id, isbn)
+                for pk, title, slug, author_id, isbn in Book.objects.values_list('pk', 'title', 'slug', 'author_id', 'isbn').iterator()
+            }
+            authors = dict(Author.objects.values_list('pk', 'name').iterator())
+        except BaseException:
+            with self.lock:
+                self.pending = None
+            raise
+        pairs = [(key, ('book', pk)) for pk, record in books.items() for key in self.keys_for('book', record)]
+        pairs += [(key, ('author', pk)) for pk, name in authors.items() for key in self.keys_for('author', name)]
+        pairs.sort()
+        keys = [key for key, _ in pairs]
+        refs = [ref for _, ref in pairs]
+        with self.lock:
+            self.keys, self.refs, self.books, self.authors = keys, refs, books, authors
+            self.version = version
+            self.checked = time.monotonic()
+            # Writes committed after the rows were read are not in them
+            for write in self.pending:
+                write()
+            self.pending = None
+
+    def refresh(self):
+        """Build the index, or start rebuilding it if another process changed the catalogue"""
+        if self.version is None:
+            # Nothing to serve yet, so the first lookup waits for the build
+            with self.build_lock:
+                if self.version is None:
+                    self.load()
+            return
+        now = time.monotonic()
+        if now - self.checked < settings.LIBRARY_AUTOCOMPLETE_RECHECK_SECONDS:
+            return
+        self.checked = now
+        version = snapshot()
+        if elsewhere(version) == elsewhere(self.version):
+            # Only this process has written, and the index already has it
+            self.version = version
+        elif self.build_lock.acquire(blocking=False):
+            self.builder = threading.Thread(target=self.rebuild, name='autocomplete-rebuild', daemon=True)
+            self.builder.start()
+
+    def rebuild(self):
+        """Body of the background rebuild; the caller holds ``build_lock``"""
+        try:
+            self.load()
+        finally:
+            connection.close()
+            self.build_lock.release()
+
+    def clear(self):
+        with self.lock:
+            self.keys, self.refs, self.books, self.authors = [], [], {}, {}
+            self.version = None
+            self.builder = None
+
+    def put(self, instance):
+        """Add or replace a saved Book or Author"""
+        if isinstance(instance, Book):
+            kind, record = 'book', (instance.title, instance.slug, instance.author_id, instance.isbn)
+        else:
+            kind, record = 'author', instance.name
+        self.apply(lambda: self._put(kind, instance.pk, record))
+
+    def remove(self, kind, pk):
+        self.apply(lambda: self._remove(kind, pk))
+
+    def apply(self, write):
+        with self.lock:
+            if self.version is None and self.pending is None:
+                # Not built yet; the first lookup will read it from the database
+                return
+            if self.version is not None:
+                write()
+            if self.pending is not None:
+                self.pending.append(write)
+
+    def _put(self, kind, pk, record):
+        self._remove(kind, pk)
+        self.records(kind)[pk] = record
+        ref = (kind, pk)
+        for key in self.keys_for(kind, record):
+            i = bisect.bisect_right(self.keys, key)
+            self.keys.insert(i, key)
+            self.refs.insert(i, ref)
+
+    def _remove(self, kind, pk):
+        record = self.records(kind).pop(pk, None)
+        if record is None:
+            return
+        ref = (kind, pk)
+        for key in self.keys_for(kind, record):
+            i = bisect.bisect_left(self.keys, key)
+            while self.refs[i] != ref:
+                i += 1
+            del self.keys[i]
+            del self.refs[i]
+
+    def suggest(self, query, limit=10):
+        """Up to ``limit`` entries with a word, or the ISBN, starting with ``query``.
+
+        Each is a dict of ``kind`` ("book" or "author"), ``pk``, ``label``,
+        and for books ``slug`` and ``author`` (the author's name).
+        """
+        self.refresh()
+        prefixes = [normalize(query)]
+        if ISBN_QUERY.fullmatch(query.strip()):
+            prefixes.append(normalize_isbn(query))
+        found = {}
+        with self.lock:
+            for prefix in filter(None, prefixes):
+                i = bisect.bisect_left(self.keys, prefix)
+                while i < len(self.keys) and len(found) < limit and self.keys[i].startswith(prefix):
+                    found.setdefault(self.refs[i], None)
+                    i += 1
+            return [self.suggestion(kind, pk) for kind, pk in found]
+
+    def suggestion(self, kind, pk):
+        if kind == 'author':
+            return {'kind': kind, 'pk': pk, 'label': self.authors[pk]}
+        title, slug, author_id, _ = self.books[pk]
+        return {'kind': kind, 'pk': pk, 'label': title, 'slug': slug, 'author': self.authors.get(author_id, '')}
+
+
+index = PrefixIndex()
@@ -0,0 +1,52 @@
+"""Helpers shared by the ``bench_*`` management commands."""
+import os
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connections
+
+
+@contextmanager
+def scratch_database(alias='default', verbosity=0):
+    """Point ``alias`` at a freshly migrated throwaway database for the block.
+
+    Benchmarks write a lot of synthetic rows, so they never run against the
+    configured database. On SQLite the scratch database is a file rather
+    than ``:memory:`` so that worker threads share it, and transactions take
+    the write lock up front as they would in production.
+    """
+    connection = connections[alias]
+    if connection.vendor == 'sqlite':
+        directory = tempfile.mkdtemp(prefix='library-bench-')
+        connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+        connection.settings_dict['OPTIONS'].update(timeout=60, transaction_mode='IMMEDIATE')
+    old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity)
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """Millisecond percentiles of a list of second timings"""
+    if not samples:
+        return {f'p{p}': None for p in points}
+    ordered = sorted(samples)
+    result = {}
+    for p in points:
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        result[f'p{p}'] = round(ordered[index] * 1000, 3)
+    result['mean'] = round(statistics.fmean(ordered) * 1000, 3)
+    return result
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
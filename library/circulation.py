@@ -0,0 +1,187 @@
+"""Issuing and returning loans.
+
+Both operations run in a single transaction and never read-modify-write
+``Book.available_copies`` in Python. Issuing decrements the counter with a
+conditional ``UPDATE ... WHERE available_copies > 0``, so concurrent desks
+cannot lend the same last copy twice. Returning locks the loan row first,
+so a loan can only be returned once. Members whose unpaid fines exceed
+``LIBRARY_FINE_BLOCK_BALANCE`` cannot borrow.
+
+Members can queue for a book with no copies on the shelf by placing a
+``Hold``. A returned copy goes to the first waiting hold, ordered by
+priority and then by age. That hold is found by a single index range read
+on ``hold_queue_idx``, so returns cost the same number of queries however
+long the queue is. The copy stays off the shelf until the member borrows
+it, or until ``expire_holds`` passes it on after
+``LIBRARY_HOLD_PICKUP_DAYS``.
+
+On SQLite, set ``"transaction_mode": "IMMEDIATE"`` in the database OPTIONS
+so each transaction takes the write lock when it begins.
+"""
+from collections import Counter
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Least
+from django.utils import timezone
+
+from . import fines, tasks, versions
+from .models import Book, Hold, Loan, Member
+
+
+class CirculationError(Exception):
+    pass
+
+
+class BookUnavailable(CirculationError):
+    pass
+
+
+class LoanAlreadyReturned(CirculationError):
+    pass
+
+
+class BorrowingBlocked(CirculationError):
+    pass
+
+
+class HoldNotNeeded(CirculationError):
+    pass
+
+
+class AlreadyOnHold(CirculationError):
+    pass
+
+
+class HoldNotActive(CirculationError):
+    pass
+
+
+def default_due_date(today=None):
+    days = getattr(settings, 'LIBRARY_LOAN_DAYS', 14)
+    return (today or timezone.localdate()) + timedelta(days=days)
+
+
+def issue_loan(book, member, due_date=None):
+    """Lend one copy of ``book`` to ``member`` or raise BookUnavailable or BorrowingBlocked"""
+    limit = fines.block_balance()
+    if limit is not None and Member.objects.filter(pk=member.pk, fine_balance__gt=limit).exists():
+        raise BorrowingBlocked(f'{member} owes more than ${limit} in fines.')
+    with transaction.atomic():
+        # A copy set aside for the member's hold is already off the shelf
+        claimed = Hold.objects.filter(book=book, member=member, status=Hold.READY).update(status=Hold.FULFILLED)
+        if not claimed:
+            taken = Book.objects.filter(pk=book.pk, available_copies__gt=0).update(
+                available_copies=F('available_copies') - 1
+            )
+            if not taken:
+                raise BookUnavailable(f'No copies of "{book}" are available.')
+        return Loan.objects.create(
+            book=book,
+            member=member,
+            due_date=due_date or default_due_date(),
+        )
+
+
+def return_loan(loan, return_date=None):
+    """Close ``loan`` and pass its copy to the next hold, or put it back on the shelf.
+
+    The returned loan's ``held`` is True when the copy went to a hold.
+    """
+    with transaction.atomic():
+        loan = Loan.objects.select_for_update().get(pk=loan.pk)
+        if loan.return_date is not None:
+            raise LoanAlreadyReturned(f'Loan #{loan.pk} was already returned.')
+        loan.return_date = return_date or timezone.localdate()
+        loan.save(update_fields=['return_date'])
+        loan.held = bool(release_copies(loan.book_id, 1, timezone.localdate()))
+    return loan
+
+
+def pickup_days():
+    return getattr(settings, 'LIBRARY_HOLD_PICKUP_DAYS', 7)
+
+
+def release_copies(book_id, copies, today):
+    """Hand ``copies`` freed copies of a book to its first waiting holds.
+
+    Copies left over go back on the shelf. Returns how many went to holds.
+    These are bulk updates, so the caller bumps the ``circulation`` and
+    ``book:<pk>`` versions.
+    """
+    allocated = 0
+    while allocated < copies:
+        queue = Hold.objects.filter(book_id=book_id, status=Hold.WAITING).order_by('-priority', 'id')
+        pks = list(queue.values_list('pk', flat=True)[:copies - allocated])
+        if not pks:
+            break
+        # A concurrent return may have readied some of them first; go round again
+        allocated += Hold.objects.filter(pk__in=pks, status=Hold.WAITING).update(
+            status=Hold.READY, ready_on=today, expires_on=today + timedelta(days=pickup_days()),
+        )
+    if allocated < copies:
+        Book.objects.filter(pk=book_id).update(
+            available_copies=Least(F('available_copies') + (copies - allocated), F('total_copies'))
+        )
+    return allocated
+
+
+def place_hold(book, member, priority=0):
+    """Queue ``member`` for ``book``, or raise HoldNotNeeded or AlreadyOnHold"""
+    with transaction.atomic():
+        # The book row lock serializes holds on one title, so checks below cannot race
+        available = Book.objects.select_for_update().values_list('available_copies', flat=True).get(pk=book.pk)
+        if available > 0:
+            raise HoldNotNeeded(f'"{book}" is on the shelf; issue it instead.')
+        if Hold.objects.filter(book=book, member=member, status__in=Hold.ACTIVE).exists():
+            raise AlreadyOnHold(f'{member} already has a hold on "{book}".')
+        return Hold.objects.create(book=book, member=member, priority=priority)
+
+
+def cancel_hold(hold):
+    """Cancel an active hold; a copy set aside for it goes to the next hold"""
+    with transaction.atomic():
+        hold = Hold.objects.select_for_update().get(pk=hold.pk)
+        if hold.status not in Hold.ACTIVE:
+            raise HoldNotActive(f'Hold #{hold.pk} is already {hold.get_status_display().lower()}.')
+        was_ready = hold.status == Hold.READY
+        hold.status = Hold.CANCELLED
+        hold.save(update_fields=['status'])
+        if was_ready:
+            release_copies(hold.book_id, 1, timezone.localdate())
+    return hold
+
+
+def expire_holds(today=None, batch_size=1000):
+    """Expire ready holds not collected in time and pass their copies on.
+
+    Works through ``batch_size`` holds per transaction. The freed copies of
+    each book are handed out together: one read of the queue and one
+    ``UPDATE`` per book. Returns the number of holds expired.
+    """
+    today = today or timezone.localdate()
+    expired = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Hold.objects.select_for_update()
+                .filter(status=Hold.READY, expires_on__lt=today)
+                .order_by('expires_on', 'id')
+                .values_list('pk', 'book_id')[:batch_size]
+            )
+            if not rows:
+                return expired
+            Hold.objects.filter(pk__in=[pk for pk, _ in rows]).update(status=Hold.EXPIRED)
+            freed = Counter(book_id for _, book_id in rows)
+            for book_id, copies in freed.items():
+                release_copies(book_id, copies, today)
+            versions.bump_on_commit('circulation', *('book:%s' % book_id for book_id in freed))
+        expired += len(rows)
+
+
+@tasks.task(concurrency=1)
+def expire_unclaimed_holds(on=None):
+    """Queued form of ``manage.py expire_holds``, as of ``on`` (ISO date) or today"""
+    expire_holds(date.fromisoformat(on) if on else None)
@@ -0,0 +1,68 @@
+"""Running independent queries at the same time from async views.
+
+Django's async ORM methods (``aget``, ``acount``, ...) all hand their work
+to the single thread that owns the request's database connection, so
+awaiting several of them with ``asyncio.gather`` still runs the queries one
+after another. ``gather`` instead runs each blocking callable with
+``sync_to_async(thread_sensitive=False)``. Every pool thread has its own
+connection, so the round trips to the database overlap. Pool threads
+release their connection after each call according to ``CONN_MAX_AGE``,
+just as a request would.
+
+This only pays off under ASGI, where the server's event loop, and so its
+executor threads and their connections, live as long as the process.
+``LibraryManagement/asgi.py`` sets ``serving_asgi``. Under WSGI each async
+view runs on an event loop of its own, so every branch would open and
+close a connection of its own, which costs more than the queries it
+overlaps. There the callables run one after another on the request's
+connection, as they also do inside a transaction (for instance in a
+``TestCase``, where other connections cannot see uncommitted rows) and
+with ``LIBRARY_CONCURRENT_QUERIES = False``.
+"""
+import asyncio
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, connections
+
+# Set by the ASGI entry point; see the module docstring
+serving_asgi = False
+
+
+def call_and_release(func):
+    try:
+        return func()
+    finally:
+        close_old_connections()
+
+
+def call_all(funcs):
+    return [func() for func in funcs]
+
+
+def in_transaction():
+    return connection.in_atomic_block
+
+
+async def gather(*funcs):
+    """Results of calling each of ``funcs``, in order"""
+    if (
+        not serving_asgi
+        or not getattr(settings, 'LIBRARY_CONCURRENT_QUERIES', True)
+        or await sync_to_async(in_transaction)()
+    ):
+        return await sync_to_async(call_all)(funcs)
+    return await asyncio.gather(*(
+        sync_to_async(call_and_release, thread_sensitive=False)(func) for func in funcs
+    ))
+
+
+def init_worker():
+    """``initializer`` for the process pools of management commands.
+
+    Each process needs its own app registry and database connections.
+    Modules a spawned worker loads before this runs must not import models.
+    """
+    django.setup()
+    connections.close_all()
@@ -0,0 +1,162 @@
+"""Overdue fine assessment.
+
+A loan that is still out past its due date carries one unpaid ``Fine``
+whose amount grows by ``LIBRARY_FINE_PER_DAY`` for each day overdue, up to
+``LIBRARY_FINE_CAP``. Assessment walks the loan table in primary key
+chunks. Loans in a chunk are grouped by the amount they owe, so each group
+costs one ``UPDATE`` and all new fines cost one ``INSERT``, however many
+rows are involved. A rerun finds nothing left to change.
+
+Each member's unpaid total is kept in ``Member.fine_balance``, so showing
+it or checking it before a loan is a single-row read. Every write to the
+fines table recomputes the balance of the members it touched, in the same
+transaction: assessment per chunk, ``pay`` per payment, and the signal
+handlers for single saves. ``manage.py rebuild_loan_counters`` recomputes
+it for everyone.
+"""
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DecimalField, Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import tasks
+from .models import Fine, JobCheckpoint, Loan, Member
+
+
+def fine_per_day():
+    return Decimal(str(getattr(settings, 'LIBRARY_FINE_PER_DAY', '0.25')))
+
+
+def fine_cap():
+    return Decimal(str(getattr(settings, 'LIBRARY_FINE_CAP', '25.00')))
+
+
+def fine_amount(due_date, today):
+    days = (today - due_date).days
+    return min(fine_per_day() * days, fine_cap())
+
+
+def block_balance():
+    """Balance above which a member may not borrow, or None for no limit"""
+    value = getattr(settings, 'LIBRARY_FINE_BLOCK_BALANCE', None)
+    return None if value is None else Decimal(str(value))
+
+
+def unpaid_total():
+    """Sum of the unpaid fines of the member in the outer query"""
+    totals = (
+        Fine.objects.filter(member=OuterRef('pk'), paid=False)
+        .order_by()
+        .values('member')
+        .annotate(total=Sum('amount'))
+        .values('total')
+    )
+    field = DecimalField(max_digits=10, decimal_places=2)
+    return Coalesce(Subquery(totals, output_field=field), Decimal('0'), output_field=field)
+
+
+def refresh_balances(members):
+    """Recompute ``fine_balance`` for the ``members`` queryset"""
+    return members.update(fine_balance=unpaid_total())
+
+
+def pay(member, fine_ids=None):
+    """Mark ``member``'s unpaid fines (or just ``fine_ids``) paid; returns how many"""
+    with transaction.atomic():
+        fines = Fine.objects.filter(member=member, paid=False)
+        if fine_ids is not None:
+            fines = fines.filter(pk__in=fine_ids)
+        paid = fines.update(paid=True)
+        if paid:
+            refresh_balances(Member.objects.filter(pk=member.pk))
+    return paid
+
+
+def overdue_loans(today):
+    return Loan.objects.filter(return_date__isnull=True, due_date__lt=today)
+
+
+def overdue_key_range(today):
+    """(first, last) overdue loan id, or None when nothing is overdue"""
+    bounds = overdue_loans(today).aggregate(first=Min('pk'), last=Max('pk'))
+    if bounds['first'] is None:
+        return None
+    return bounds['first'], bounds['last']
+
+
+def assess_chunk(start, stop, today):
+    """Bring fines for overdue loans with ``start <= id < stop`` up to date.
+
+    Returns ``(loans_seen, fines_created, fines_updated)``.
+    """
+    with transaction.atomic():
+        # Locking the chunk's loans serializes assessments that overlap, such
+        # as the cron command and the queued task, so a loan is fined once
+        loans = list(
+            overdue_loans(today).filter(pk__gte=start, pk__lt=stop)
+            .select_for_update().values_list('pk', 'due_date', 'member_id')
+        )
+        if not loans:
+            return 0, 0, 0
+
+        by_amount = defaultdict(list)
+        members = {}
+        for loan_id, due_date, member_id in loans:
+            by_amount[fine_amount(due_date, today)].append(loan_id)
+            members[loan_id] = member_id
+        # Paid fines are settled and never reopened
+        fined = set(Fine.objects.filter(loan_id__in=[pk for pk, _, _ in loans]).values_list('loan_id', flat=True))
+
+        updated = 0
+        for amount, loan_ids in by_amount.items():
+            updated += Fine.objects.filter(loan_id__in=loan_ids, paid=False).exclude(amount=amount).update(amount=amount)
+        created = Fine.objects.bulk_create([
+            Fine(loan_id=loan_id, member_id=members[loan_id], amount=amount)
+            for amount, loan_ids in by_amount.items()
+            for loan_id in loan_ids
+            if loan_id not in fined
+        ])
+        if created or updated:
+            refresh_balances(Member.objects.filter(pk__in=set(members.values())))
+    return len(loans), len(created), updated
+
+
+def checkpoint_name(today, start):
+    return f'assess_fines:{today.isoformat()}:{start}'
+
+
+def assess_range(start, stop, today, chunk_size=5000, resume=True):
+    """Assess every chunk of ``[start, stop)``, recording progress as it goes"""
+    checkpoint, _ = JobCheckpoint.objects.get_or_create(
+        name=checkpoint_name(today, start), defaults={'position': start}
+    )
+    position = checkpoint.position if resume else start
+    totals = [0, 0, 0]
+    while position < stop:
+        chunk_stop = min(position + chunk_size, stop)
+        for i, count in enumerate(assess_chunk(position, chunk_stop, today)):
+            totals[i] += count
+        position = chunk_stop
+        JobCheckpoint.objects.filter(pk=checkpoint.pk).update(position=position)
+    return tuple(totals)
+
+
+def split_range(first, last, parts):
+    """Split the inclusive id range into ``parts`` contiguous half-open ranges"""
+    stop = last + 1
+    size = max(1, -(-(stop - first) // parts))
+    return [(start, min(start + size, stop)) for start in range(first, stop, size)]
+
+
+@tasks.task(concurrency=1)
+def assess_overdue(on=None):
+    """Queued form of ``manage.py assess_fines``, as of ``on`` (ISO date) or today"""
+    today = date.fromisoformat(on) if on else timezone.localdate()
+    key_range = overdue_key_range(today)
+    if key_range is not None:
+        assess_range(key_range[0], key_range[1] + 1, today)
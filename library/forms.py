@@ -1,24 +1,57 @@
 from django import forms
-from django.utils.text import slugify
-from .models import Book, Author, Category
+from django.urls import reverse_lazy
+from .models import Book, Author, Category, Member, Loan
+from .slugs import allocate_slugs
+
+
+class LookupWidgetMixin:
+    """Renders only the selected options of a model choice field.
+
+    Other choices are fetched from the ``lookup`` endpoint for ``kind`` as
+    staff type (see library/lookups.py), so the page never lists the whole
+    table. The field still validates just the submitted primary keys.
+    """
+
+    def __init__(self, kind, attrs=None):
+        attrs = {**(attrs or {}), 'data-lookup-url': reverse_lazy('lookup', args=[kind])}
+        super().__init__(attrs)
+
+    def optgroups(self, name, value, attrs=None):
+        field = self.choices.field
+        selected = [pk for pk in value if pk and str(pk).isdigit()]
+        options = []
+        if not self.allow_multiple_selected and field.empty_label is not None:
+            options.append(self.create_option(name, '', field.empty_label, not selected, 0, attrs=attrs))
+        for obj in field.queryset.filter(pk__in=selected) if selected else ():
+            options.append(self.create_option(name, obj.pk, field.label_from_instance(obj), True, len(options), attrs=attrs))
+        return [(None, [option], option['index']) for option in options]
+
+
+class LookupSelect(LookupWidgetMixin, forms.Select):
+    pass
+
+
+class LookupSelectMultiple(LookupWidgetMixin, forms.SelectMultiple):
+    pass
 
 
 class BookForm(forms.ModelForm):
-    # Override the author field to show a dropdown with existing authors
+    # Existing authors and categories are searched as staff type rather
+    # than listed in full
     author = forms.ModelChoiceField(
         queryset=Author.objects.all(),
         empty_label="Select an Author",
-        widget=forms.Select(attrs={
+        widget=LookupSelect('author', attrs={
             'class': 'form-select',
             'id': 'id_author'
         })
     )
     
-    # Override categories field for better display
     category = forms.ModelMultipleChoiceField(
         queryset=Category.objects.all(),
-        widget=forms.CheckboxSelectMultiple(attrs={
-            'class': 'form-check-input'
+        widget=LookupSelectMultiple('category', attrs={
+            'class': 'form-select',
+            'size': 6
         }),
         required=False,
         label="Categories"
@@ -154,13 +187,7 @@ class BookForm(forms.ModelForm):
         
         # Generate slug from title
         if not instance.slug:
-            base_slug = slugify(instance.title)
-            slug = base_slug
-            counter = 1
-            while Book.objects.filter(slug=slug).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            instance.slug = slug
+            instance.slug = allocate_slugs([instance.title])[0]
         
         if commit:
             instance.save()
@@ -205,4 +232,79 @@ class CategoryForm(forms.ModelForm):
                 'class': 'form-control',
                 'placeholder': 'Enter category name...'
             })
-        }
\ No newline at end of file
+        }
+
+
+class MemberForm(forms.ModelForm):
+    class Meta:
+        model = Member
+        fields = ['first_name', 'last_name', 'email', 'phone_number', 'address']
+
+
+class LoanIssueForm(forms.Form):
+    # Looked up by ISBN and member number so desks can scan rather than pick
+    # from a list of every book and member
+    book = forms.ModelChoiceField(
+        queryset=Book.objects.all(),
+        to_field_name='isbn',
+        widget=forms.TextInput(attrs={
+            'class': 'form-control',
+            'placeholder': 'Scan or enter ISBN...'
+        }),
+        error_messages={'invalid_choice': 'No book with that ISBN exists.'},
+        label="Book ISBN"
+    )
+
+    member = forms.ModelChoiceField(
+        queryset=Member.objects.all(),
+        widget=forms.NumberInput(attrs={
+            'class': 'form-control',
+            'placeholder': 'Enter member number...'
+        }),
+        error_messages={'invalid_choice': 'No member with that number exists.'},
+        label="Member Number"
+    )
+
+    due_date = forms.DateField(
+        required=False,
+        widget=forms.DateInput(attrs={
+            'class': 'form-control',
+            'type': 'date'
+        }),
+        help_text="Leave empty for the standard loan period"
+    )
+
+
+class LoanReturnForm(forms.Form):
+    loan = forms.ModelChoiceField(
+        queryset=Loan.objects.filter(return_date__isnull=True).select_related('book', 'member'),
+        widget=forms.NumberInput(attrs={
+            'class': 'form-control',
+            'placeholder': 'Enter loan number...'
+        }),
+        error_messages={'invalid_choice': 'No active loan with that number exists.'},
+        label="Loan Number"
+    )
+
+
+class HoldForm(forms.Form):
+    member = forms.ModelChoiceField(
+        queryset=Member.objects.all(),
+        widget=forms.NumberInput(attrs={
+            'class': 'form-control',
+            'placeholder': 'Enter member number...'
+        }),
+        error_messages={'invalid_choice': 'No member with that number exists.'},
+        label="Member Number"
+    )
+
+    priority = forms.IntegerField(
+        required=False,
+        min_value=0,
+        max_value=100,
+        widget=forms.NumberInput(attrs={
+            'class': 'form-control',
+            'placeholder': '0'
+        }),
+        help_text="Higher priorities are served first"
+    )
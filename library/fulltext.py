@@ -0,0 +1,295 @@
+"""Full-text search over books, authors and members.
+
+Each searchable model gets its own index table, keyed by the object's
+primary key and holding a single ``body`` column with the text to match.
+The backend is picked from ``settings.LIBRARY_SEARCH_BACKEND`` or, by
+default, from the database vendor: SQLite uses an FTS5 virtual table and
+MySQL uses an InnoDB table with a FULLTEXT index. Signal handlers in
+``library.signals`` keep the tables in sync with model saves and deletes.
+"""
+import re
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, router
+from django.utils.module_loading import import_string
+
+from .pagination import InvalidCursor, KeysetPage, decode_cursor, encode_cursor
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def book_document(book):
+    return ' '.join([book.title, book.author.name, book.isbn, book.isbn.replace('-', '')])
+
+
+def author_document(author):
+    return author.name
+
+
+def member_document(member):
+    return ' '.join([member.first_name, member.last_name, member.email])
+
+
+# kind -> (model name, document builder, related fields the builder reads)
+INDEXES = {
+    'book': ('Book', book_document, ('author',)),
+    'author': ('Author', author_document, ()),
+    'member': ('Member', member_document, ()),
+}
+
+
+def tokenize(query):
+    return TOKEN_RE.findall((query or '').lower())
+
+
+class BaseSearchBackend:
+    def __init__(self, using='default'):
+        self.using = using
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def table(self, kind):
+        return 'library_search_%s' % kind
+
+    def create_schema(self, kind):
+        raise NotImplementedError
+
+    def drop_schema(self, kind):
+        with self.connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS %s' % self.table(kind))
+
+    def index(self, kind, documents):
+        """Insert or replace ``(object_id, body)`` pairs"""
+        raise NotImplementedError
+
+    def remove(self, kind, object_ids):
+        object_ids = list(object_ids)
+        if not object_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(object_ids))
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM %s WHERE %s IN (%s)' % (self.table(kind), self.id_column, placeholders),
+                object_ids,
+            )
+
+    def clear(self, kind):
+        with self.connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % self.table(kind))
+
+    def search(self, kind, query, limit=10, offset=0, within=None):
+        """Return matching object ids, best match first, skipping the first ``offset``.
+
+        ``within`` is an ``(sql, params)`` query for the ids the matches
+        must also be among.
+        """
+        raise NotImplementedError
+
+    def restriction(self, within):
+        if within is None:
+            return '', []
+        sql, params = within
+        return ' AND %s IN (%s)' % (self.id_column, sql), list(params)
+
+
+class SQLiteFTS5Backend(BaseSearchBackend):
+    # FTS5 tables address rows by rowid, which we set to the object's pk
+    id_column = 'rowid'
+
+    def create_schema(self, kind):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5("
+                "body, tokenize = 'unicode61 remove_diacritics 2')" % self.table(kind)
+            )
+
+    def index(self, kind, documents):
+        documents = list(documents)
+        if not documents:
+            return
+        # FTS5 has no upsert, so replace rows by deleting them first
+        self.remove(kind, [object_id for object_id, body in documents])
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO %s (rowid, body) VALUES (%%s, %%s)' % self.table(kind),
+                documents,
+            )
+
+    def search(self, kind, query, limit=10, offset=0, within=None):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        # Every token must match, as a prefix so partial words and ISBNs hit
+        match = ' '.join('"%s"*' % token for token in tokens)
+        restrict, params = self.restriction(within)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid FROM {0} WHERE {0} MATCH %s{1} ORDER BY rank LIMIT %s OFFSET %s'.format(self.table(kind), restrict),
+                [match, *params, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class MySQLFulltextBackend(BaseSearchBackend):
+    id_column = 'object_id'
+
+    def create_schema(self, kind):
+        table = self.table(kind)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE IF NOT EXISTS %s ('
+                'object_id BIGINT NOT NULL PRIMARY KEY, '
+                'body LONGTEXT NOT NULL, '
+                'FULLTEXT KEY %s_body (body)'
+                ') ENGINE=InnoDB DEFAULT CHARSET=utf8mb4' % (table, table)
+            )
+
+    def index(self, kind, documents):
+        documents = list(documents)
+        if not documents:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                'REPLACE INTO %s (object_id, body) VALUES (%%s, %%s)' % self.table(kind),
+                documents,
+            )
+
+    def search(self, kind, query, limit=10, offset=0, within=None):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        match = ' '.join('+%s*' % token for token in tokens)
+        restrict, params = self.restriction(within)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT object_id FROM {0} '
+                'WHERE MATCH(body) AGAINST (%s IN BOOLEAN MODE){1} '
+                'ORDER BY MATCH(body) AGAINST (%s IN BOOLEAN MODE) DESC, object_id '
+                'LIMIT %s OFFSET %s'.format(self.table(kind), restrict),
+                [match, *params, match, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTS5Backend,
+    'mysql': MySQLFulltextBackend,
+}
+
+
+def backend_for(using='default'):
+    path = getattr(settings, 'LIBRARY_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)(using)
+    vendor = connections[using].vendor
+    try:
+        return BACKENDS[vendor](using)
+    except KeyError:
+        raise ImproperlyConfigured(
+            'No full-text search backend for %r; set LIBRARY_SEARCH_BACKEND.' % vendor
+        )
+
+
+def get_backend(model):
+    return backend_for(router.db_for_write(model))
+
+
+def kind_for(model):
+    return model._meta.model_name
+
+
+def index_instances(model, instances):
+    kind = kind_for(model)
+    document = INDEXES[kind][1]
+    get_backend(model).index(kind, [(obj.pk, document(obj)) for obj in instances])
+
+
+def index_objects(model, pks):
+    """(Re)index the given objects of ``model`` from the database"""
+    related = INDEXES[kind_for(model)][2]
+    index_instances(model, model._default_manager.filter(pk__in=list(pks)).select_related(*related))
+
+
+def remove_objects(model, pks):
+    get_backend(model).remove(kind_for(model), pks)
+
+
+def rebuild(apps, using='default', chunk_size=2000):
+    """Repopulate every index from scratch; ``apps`` may be historical models"""
+    backend = backend_for(using)
+    for kind, (model_name, document, related) in INDEXES.items():
+        model = apps.get_model('library', model_name)
+        backend.clear(kind)
+        queryset = model._default_manager.using(using).select_related(*related).order_by('pk')
+        batch = []
+        for obj in queryset.iterator(chunk_size=chunk_size):
+            batch.append((obj.pk, document(obj)))
+            if len(batch) >= chunk_size:
+                backend.index(kind, batch)
+                batch = []
+        backend.index(kind, batch)
+
+
+def search_ids(model, query, limit=10, offset=0, within=None):
+    """Ids of the best matches of ``query``, among those of the queryset ``within`` if given"""
+    # The index tables are replicated along with everything else
+    using = router.db_for_read(model)
+    restrict = None
+    if within is not None and within.query.where:
+        # Filtered in the index query itself, so ranks count only these rows
+        restrict = within.order_by().values('pk').query.get_compiler(using).as_sql()
+    return backend_for(using).search(kind_for(model), query, limit, offset, restrict)
+
+
+def search(queryset, query, limit=10):
+    """Objects from ``queryset`` matching ``query``, in relevance order"""
+    ids = search_ids(queryset.model, query, limit)
+    objects = queryset.in_bulk(ids)
+    return [objects[pk] for pk in ids if pk in objects]
+
+
+def ranked_matches(queryset, query, start, stop):
+    """``(rank, object)`` for the matches in ``queryset`` ranked ``start`` to ``stop``"""
+    ids = search_ids(queryset.model, query, limit=stop - start, offset=start, within=queryset)
+    objects = queryset.in_bulk(ids)
+    return [(start + i, objects[pk]) for i, pk in enumerate(ids) if pk in objects]
+
+
+def search_page(queryset, query, after=None, before=None, per_page=25):
+    """One ``KeysetPage`` of the matches in ``queryset``, in relevance order.
+
+    The cursors hold rank positions among those matches. Filters on
+    ``queryset`` are part of the index query, so any page costs one index
+    query however selective they are.
+    """
+    if before is not None:
+        stop = cursor_rank(before)
+        start = max(0, stop - per_page)
+        rows = ranked_matches(queryset, query, start, stop)
+        prev_cursor = encode_cursor([start]) if start > 0 else None
+        return KeysetPage([obj for _, obj in rows], encode_cursor([stop]), prev_cursor)
+
+    start = cursor_rank(after) if after is not None else 0
+    found = ranked_matches(queryset, query, start, start + per_page + 1)
+    rows = found[:per_page]
+    next_cursor = encode_cursor([start + per_page]) if len(found) > per_page else None
+    prev_cursor = encode_cursor([start]) if rows and start > 0 else None
+    return KeysetPage([obj for _, obj in rows], next_cursor, prev_cursor)
+
+
+def cursor_rank(token):
+    values = decode_cursor(token)
+    if len(values) != 1 or not isinstance(values[0], int) or values[0] < 0:
+        raise InvalidCursor(token)
+    return values[0]
+
+
+def paginate(request, queryset, query, per_page=25):
+    """Like ``pagination.paginate``, for the matches of ``query`` in relevance order"""
+    try:
+        return search_page(queryset, query, request.GET.get('after'), request.GET.get('before'), per_page)
+    except InvalidCursor:
+        return search_page(queryset, query, per_page=per_page)
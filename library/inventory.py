@@ -0,0 +1,101 @@
+"""Reconciliation of ``Book.available_copies`` with the loan and hold tables.
+
+A book's copies are on loan, set aside for a ready hold, or on the shelf,
+so ``available_copies`` should equal ``total_copies`` less its open loans
+and ready holds. Circulation keeps it so, but staff can type any value in
+the book form or the admin. ``reconcile`` finds the books that have
+drifted, and can repair them.
+
+It walks the book table in primary key chunks. Each chunk is one query
+that computes the expected count with correlated subqueries and returns
+only the books that differ. Repairs lock just the drifted rows, recompute
+them under the lock and write them with one ``bulk_update``, so each
+transaction is short and never locks a whole chunk. Progress is kept in a
+``JobCheckpoint``, so an interrupted run picks up where it stopped.
+"""
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import BigIntegerField, Count, F, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Cast, Coalesce, Greatest
+
+from . import versions
+from .models import Book, Hold, JobCheckpoint, Loan
+
+CHECKPOINT = 'reconcile_inventory'
+
+Drift = namedtuple('Drift', 'book_id isbn title total_copies available_copies expected open_loans ready_holds')
+
+
+def count_of(queryset):
+    counts = queryset.order_by().values('book').annotate(n=Count('pk')).values('n')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def with_expected(books):
+    """Annotate ``open_loans``, ``ready_holds`` and the ``expected`` available copies"""
+    return books.annotate(
+        open_loans=count_of(Loan.objects.filter(book=OuterRef('pk'), return_date__isnull=True)),
+        ready_holds=count_of(Hold.objects.filter(book=OuterRef('pk'), status=Hold.READY)),
+        # More copies out than owned can only be reported, not shelved. MySQL
+        # subtracts from an unsigned column in unsigned arithmetic, which
+        # fails below zero, so the difference is taken as signed.
+        expected=Greatest(Cast('total_copies', BigIntegerField()) - F('open_loans') - F('ready_holds'), 0),
+    )
+
+
+def drifted(books):
+    rows = (
+        with_expected(books)
+        .exclude(available_copies=F('expected'))
+        .order_by('pk')
+        .values_list('pk', 'isbn', 'title', 'total_copies', 'available_copies', 'expected', 'open_loans', 'ready_holds')
+    )
+    return [Drift(*row) for row in rows]
+
+
+def repair(book_ids):
+    """Set ``available_copies`` of the given books to their expected value.
+
+    Returns the rows actually changed, as they were before the repair.
+    """
+    with transaction.atomic():
+        # Issuing or shelving a copy needs these row locks to commit; a
+        # return handed to a hold leaves the expected count unchanged
+        list(Book.objects.select_for_update().filter(pk__in=book_ids).values_list('pk'))
+        rows = drifted(Book.objects.filter(pk__in=book_ids))
+        Book.objects.bulk_update(
+            [Book(pk=row.book_id, available_copies=row.expected) for row in rows], ['available_copies'],
+        )
+        if rows:
+            # bulk_update sends no signals
+            versions.bump_on_commit('book', *('book:%s' % row.book_id for row in rows))
+    return rows
+
+
+def reconcile(fix=False, chunk_size=1000, resume=True, report=None):
+    """Check every book, or those after the checkpoint when ``resume`` is set.
+
+    Each drifted book is passed to ``report`` as a ``Drift``; with ``fix``
+    it is also repaired. Returns ``(books_checked, drifted, repaired)``.
+    """
+    checkpoint, _ = JobCheckpoint.objects.get_or_create(name=CHECKPOINT)
+    position = checkpoint.position if resume else 0
+    last_id = Book.objects.aggregate(last=Max('pk'))['last'] or 0
+    checked = found = repaired = 0
+    while position <= last_id:
+        chunk = Book.objects.filter(pk__gte=position, pk__lt=position + chunk_size)
+        rows = drifted(chunk)
+        if fix and rows:
+            # A book put right by circulation in the meantime is left alone
+            repaired += len(repair([row.book_id for row in rows]))
+        if report:
+            for row in rows:
+                report(row)
+        checked += chunk.count()
+        found += len(rows)
+        position += chunk_size
+        JobCheckpoint.objects.filter(pk=checkpoint.pk).update(position=position)
+    # A finished run starts from the beginning next time
+    JobCheckpoint.objects.filter(pk=checkpoint.pk).update(position=0)
+    return checked, found, repaired
@@ -1,6 +1,19 @@
+import hashlib
+import os
+import time
+
+from django.conf import settings
 from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import caches
+from django.template.defaultfilters import date, pluralize, truncatechars, truncatewords
 from django.urls import reverse
-from jinja2 import Environment
+from django.utils import timezone
+from jinja2 import Environment, FileSystemBytecodeCache, MemcachedBytecodeCache, Template, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from . import metrics
+from .versions import lookup as lookup_versions
 
 
 def url_for(name, *args, **kwargs):
@@ -8,11 +21,103 @@ def url_for(name, *args, **kwargs):
     return reverse(name, args=args, kwargs=kwargs)
 
 
+def query_string(request, **params):
+    """Current query string with ``params`` replaced (None removes a key)"""
+    query = request.GET.copy()
+    for key, value in params.items():
+        if value is None:
+            query.pop(key, None)
+        else:
+            query[key] = value
+    encoded = query.urlencode()
+    return '?' + encoded if encoded else '?'
+
+
+class TimedTemplate(Template):
+    """Template that reports its render time to the request metrics"""
+
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            metrics.add_render_time(time.perf_counter() - start)
+
+
+class FragmentCacheExtension(Extension):
+    """Cache the output of a block in the Django cache.
+
+    ::
+
+        {% cache 'popular-books', today, versions=['book', 'circulation'], timeout=600 %}
+            ...
+        {% endcache %}
+
+    The key is the fragment name, the positional vary values, and the current
+    ``library.versions`` counters for ``versions``. A write to any of those
+    models therefore retires the fragment without explicit invalidation.
+    Counters are read once per request, however many fragments share them.
+    """
+    tags = {'cache'}
+    prefix = 'library:fragment:'
+    timeout = 300
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        vary = [parser.parse_expression()]
+        options = []
+        while parser.stream.skip_if('comma'):
+            if parser.stream.current.type == 'name' and parser.stream.look().type == 'assign':
+                key = next(parser.stream).value
+                next(parser.stream)
+                options.append(nodes.Keyword(key, parser.parse_expression()))
+            else:
+                vary.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        call = self.call_method('_render', [nodes.ContextReference(), nodes.List(vary)], options)
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, context, vary, versions=(), timeout=None, caller=None):
+        state = lookup_versions(versions, context.get('request'))[0] if versions else ''
+        source = '|'.join(str(value) for value in vary) + '|' + state
+        key = self.prefix + hashlib.sha1(source.encode()).hexdigest()
+        cache = caches[getattr(settings, 'LIBRARY_FRAGMENT_CACHE', 'default')]
+        html = cache.get(key)
+        if html is None:
+            html = str(caller())
+            cache.set(key, html, self.timeout if timeout is None else timeout)
+        return Markup(html)
+
+
+def bytecode_cache():
+    """Where compiled templates are kept between processes, per the settings"""
+    alias = getattr(settings, 'LIBRARY_TEMPLATE_BYTECODE_CACHE', None)
+    if alias:
+        # Django cache backends have the get/set(key, value, timeout) client API
+        return MemcachedBytecodeCache(caches[alias], prefix='library:jinja2:')
+    directory = getattr(settings, 'LIBRARY_TEMPLATE_BYTECODE_DIR', None)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        return FileSystemBytecodeCache(str(directory))
+    return None
+
+
 def environment(**options):
+    options.setdefault('bytecode_cache', bytecode_cache())
+    options['extensions'] = [*options.get('extensions', ()), FragmentCacheExtension]
     env = Environment(**options)
+    env.template_class = TimedTemplate
     env.globals.update({
         'static': staticfiles_storage.url,
         'url': reverse,
         'url_for': url_for,
+        'query_string': query_string,
+        'now': timezone.localtime,
+    })
+    env.filters.update({
+        'date': date,
+        'pluralize': pluralize,
+        'truncatechars': truncatechars,
+        'truncatewords': truncatewords,
     })
-    return env
\ No newline at end of file
+    return env
@@ -0,0 +1,45 @@
+"""Paginated name lookups behind the author and category pickers.
+
+::
+
+    GET /lookup/author/?q=le+gu                 authors whose name starts with "le gu"
+    GET /lookup/category/?q=sci&after=<cursor>  the next page of categories
+
+Responses are ``{"results": [{"id": ..., "text": ...}], "next": <cursor>}``,
+with ``next`` null on the last page. Matches are read in ``(name, id)``
+order from the name index, ``PER_PAGE`` at a time with keyset pagination.
+
+On MySQL, whose default collations are case-insensitive, ``istartswith``
+is a plain ``LIKE 'prefix%'`` that seeks to the prefix in the name index,
+so a lookup costs the same with fifty authors or fifty thousand. SQLite
+compiles it to ``LIKE ... ESCAPE``, which it cannot seek with: there a
+lookup walks the index in name order until it has filled a page, and a
+rare prefix can cost a walk of the whole index.
+"""
+from django.http import Http404, JsonResponse
+
+from .models import Author, Category
+from .pagination import paginate
+from .routers import replica_reads
+
+LOOKUPS = {
+    'author': Author,
+    'category': Category,
+}
+PER_PAGE = 20
+
+
+@replica_reads
+def lookup(request, kind):
+    model = LOOKUPS.get(kind)
+    if model is None:
+        raise Http404('No such lookup.')
+    queryset = model.objects.only('pk', 'name')
+    query = request.GET.get('q', '').strip()
+    if query:
+        queryset = queryset.filter(name__istartswith=query)
+    page = paginate(request, queryset, ('name', 'id'), per_page=PER_PAGE)
+    return JsonResponse({
+        'results': [{'id': obj.pk, 'text': obj.name} for obj in page],
+        'next': page.next_cursor,
+    })
@@ -0,0 +1,63 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from library.concurrency import init_worker
+from django.utils import timezone
+
+# Model-dependent imports are deferred: pool workers are spawned fresh and
+# load this module before django.setup() has run in them.
+
+
+def run_range(start, stop, today, chunk_size, resume):
+    from library import fines
+    try:
+        return fines.assess_range(start, stop, today, chunk_size=chunk_size, resume=resume)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Create or update fines for overdue loans in chunked, resumable batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, help='Assess as of this date (default: today)')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Loan ids per batch')
+        parser.add_argument('--workers', type=int, default=1, help='Split the id range across this many processes')
+        parser.add_argument('--restart', action='store_true', help="Ignore today's checkpoints and start over")
+
+    def handle(self, *args, **options):
+        from library import fines
+
+        today = options['date'] or timezone.localdate()
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError('--workers must be at least 1')
+
+        key_range = fines.overdue_key_range(today)
+        if key_range is None:
+            self.stdout.write('No overdue loans.')
+            return
+        ranges = fines.split_range(*key_range, parts=workers)
+        args = [(start, stop, today, options['chunk_size'], not options['restart']) for start, stop in ranges]
+
+        started = time.perf_counter()
+        if workers == 1:
+            results = [run_range(*arg) for arg in args]
+        else:
+            # Children must not inherit this process's open connections
+            connections.close_all()
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker) as pool:
+                results = list(pool.map(run_range, *zip(*args)))
+        elapsed = time.perf_counter() - started
+
+        seen, created, updated = (sum(column) for column in zip(*results))
+        self.stdout.write(self.style.SUCCESS(
+            f'Assessed {seen} overdue loans as of {today}: {created} fines created, '
+            f'{updated} updated in {elapsed:.1f}s ({seen / elapsed if elapsed else 0:.0f} rows/s).'
+        ))
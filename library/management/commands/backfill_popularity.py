@@ -0,0 +1,28 @@
+from datetime import date
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from library import popularity
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily loan counts and window totals behind the popular books lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help='First issue date to recompute (default: the earliest loan)')
+        parser.add_argument('--until', type=date.fromisoformat, help='Recompute issue dates before this one (default: through the latest loan)')
+        parser.add_argument('--chunk-days', type=int, default=31, help='Days recomputed per transaction')
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--roll', action='store_true', help='Only move the window totals forward to today, e.g. from a nightly cron job')
+
+    def handle(self, *args, **options):
+        if options['roll']:
+            days = popularity.roll()
+            self.stdout.write(self.style.SUCCESS(f'Rolled the window totals forward {days} day(s).'))
+            return
+        written = popularity.rebuild(
+            apps, start=options['since'], stop=options['until'],
+            chunk_days=options['chunk_days'], using=options['database'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} daily loan counts and rebuilt the window totals.'))
@@ -0,0 +1,91 @@
+import asyncio
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from library import concurrency, seed, stats
+from library.benchmarks import Timer, percentiles, scratch_database
+from library.models import Member
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare dashboard and member_detail latency through the ASGI handler with their '
+        'queries run one after another and concurrently'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=0.01, help='Dataset size relative to seed_data --scale 1')
+        parser.add_argument('--requests', type=int, default=30, help='Timed requests per view and mode')
+        parser.add_argument(
+            '--round-trip-ms', type=float, default=1.0,
+            help='Network latency added to every query, as a stand-in for a remote MySQL server',
+        )
+
+    def handle(self, *args, **options):
+        delay = options['round_trip_ms'] / 1000
+
+        def network(execute, sql, params, many, context):
+            time.sleep(delay)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            if network not in connection.execute_wrappers:
+                connection.execute_wrappers.append(network)
+
+        setup_test_environment()
+        try:
+            with override_settings(DEBUG=False), scratch_database() as connection:
+                # Pool threads keep their connections between requests, as they
+                # should under ASGI; reconnecting per query would swamp the gain
+                connection.settings_dict['CONN_MAX_AGE'] = None
+                seed.seed(rng=random.Random(0), **seed.sizes(options['scale']))
+                connection_created.connect(add_latency)
+                for existing in connections.all():
+                    add_latency(None, existing)
+                # AsyncClient goes through the ASGI handler, as asgi.py would
+                concurrency.serving_asgi = True
+                try:
+                    self.run(options['requests'])
+                finally:
+                    concurrency.serving_asgi = False
+                    connection_created.disconnect(add_latency)
+        finally:
+            teardown_test_environment()
+
+    def run(self, requests):
+        member = Member.objects.order_by('-total_loan_count').first()
+        views = {
+            # The statistics cache is cleared before each request so every aggregate is queried
+            'dashboard (cold cache)': (reverse('dashboard'), stats.get_cache().clear),
+            'member_detail': (reverse('member_detail', args=[member.pk]), None),
+        }
+        for name, (url, before) in views.items():
+            results = {}
+            for mode, concurrent in (('sequential', False), ('concurrent', True)):
+                with override_settings(LIBRARY_CONCURRENT_QUERIES=concurrent):
+                    results[mode] = asyncio.run(self.measure(url, before, requests))
+            speedup = results['sequential']['p50'] / results['concurrent']['p50']
+            self.stdout.write(name)
+            for mode, latency in results.items():
+                self.stdout.write(f'  {mode:<11} ' + ' '.join(f'{k}={v}ms' for k, v in latency.items()))
+            self.stdout.write(self.style.SUCCESS(f'  p50 speedup x{speedup:.2f}'))
+
+    async def measure(self, url, before, requests):
+        client = AsyncClient()
+        await client.get(url)
+        timings = []
+        for _ in range(requests):
+            if before:
+                before()
+            with Timer() as timer:
+                response = await client.get(url)
+            assert response.status_code == 200, response.status_code
+            timings.append(timer.elapsed)
+        return percentiles(timings)
@@ -0,0 +1,104 @@
+import threading
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+
+from library import circulation
+from library.benchmarks import Timer, percentiles, scratch_database
+from library.models import Author, Book, Loan, Member
+
+
+class Command(BaseCommand):
+    help = 'Hammer one popular book with concurrent issue/return workers on a scratch database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--operations', type=int, default=200, help='Issue attempts per worker')
+        parser.add_argument('--copies', type=int, default=3, help='Copies of the contested book')
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.run(options['workers'], options['operations'], options['copies'])
+
+    def run(self, workers, operations, copies):
+        author = Author.objects.create(name='Benchmark Author')
+        book = Book.objects.create(
+            title='Contested Title', slug='contested-title', author=author, isbn='9990000000001',
+            publisher='Bench', published_date=date(2000, 1, 1),
+            total_copies=copies, available_copies=copies,
+        )
+        members = [
+            Member.objects.create(first_name='Worker', last_name=str(n), email=f'worker{n}@bench.example')
+            for n in range(workers)
+        ]
+
+        lock = threading.Lock()
+        totals = {'issued': 0, 'unavailable': 0, 'retries': 0}
+        latencies = []
+        start = threading.Barrier(workers)
+
+        def worker(member):
+            issued = unavailable = retries = 0
+            timings = []
+            start.wait()
+            try:
+                for _ in range(operations):
+                    with Timer() as timer:
+                        while True:
+                            try:
+                                loan = circulation.issue_loan(book, member)
+                            except circulation.BookUnavailable:
+                                unavailable += 1
+                                break
+                            except OperationalError:
+                                retries += 1
+                                time.sleep(0.001)
+                                continue
+                            issued += 1
+                            while True:
+                                try:
+                                    circulation.return_loan(loan)
+                                    break
+                                except OperationalError:
+                                    retries += 1
+                                    time.sleep(0.001)
+                            break
+                    timings.append(timer.elapsed)
+            finally:
+                connections.close_all()
+            with lock:
+                totals['issued'] += issued
+                totals['unavailable'] += unavailable
+                totals['retries'] += retries
+                latencies.extend(timings)
+
+        threads = [threading.Thread(target=worker, args=(member,)) for member in members]
+        with Timer() as wall:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        book.refresh_from_db()
+        open_loans = Loan.objects.filter(book=book, return_date__isnull=True).count()
+        oversold = Loan.objects.filter(book=book).count() != totals['issued']
+        consistent = book.available_copies == copies - open_loans and not oversold
+
+        attempts = workers * operations
+        self.stdout.write(f'workers={workers} attempts={attempts} copies={copies}')
+        self.stdout.write(
+            f"issued={totals['issued']} unavailable={totals['unavailable']} "
+            f"lock_retries={totals['retries']}"
+        )
+        self.stdout.write(f'throughput={attempts / wall.elapsed:.1f} ops/s wall={wall.elapsed:.2f}s')
+        self.stdout.write('latency_ms ' + ' '.join(f'{k}={v}' for k, v in percentiles(latencies).items()))
+        if consistent:
+            self.stdout.write(self.style.SUCCESS(
+                f'available_copies={book.available_copies} matches open loans, no copy oversold'
+            ))
+        else:
+            self.stdout.write(self.style.ERROR(
+                f'INCONSISTENT: available_copies={book.available_copies} open_loans={open_loans}'
+            ))
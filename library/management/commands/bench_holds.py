@@ -0,0 +1,61 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from library import circulation
+from library.benchmarks import Timer, percentiles, scratch_database
+from library.models import Author, Book, Hold, Member
+
+
+class Command(BaseCommand):
+    help = 'Time returns that allocate the copy to a hold, for growing hold queues, on a scratch database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 10000], help='Holds queued on the title')
+        parser.add_argument('--cycles', type=int, default=200, help='Return and pick-up cycles per size')
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.run(options['sizes'], options['cycles'])
+
+    def run(self, sizes, cycles):
+        author = Author.objects.create(name='Benchmark Author')
+        members = Member.objects.bulk_create(
+            Member(first_name='Patron', last_name=str(n), email=f'patron{n}@bench.example')
+            for n in range(max(sizes) + cycles + 1)
+        )
+        for size in sizes:
+            book = Book.objects.create(
+                title=f'Queued Title {size}', slug=f'queued-title-{size}', author=author,
+                isbn=f'999{size:010d}', publisher='Bench', published_date=date(2000, 1, 1),
+                total_copies=1, available_copies=1,
+            )
+            loan = circulation.issue_loan(book, members[-1])
+            # Every tenth hold jumps the queue, so the order is not just insertion order
+            Hold.objects.bulk_create(
+                (Hold(book=book, member=member, priority=int(n % 10 == 0)) for n, member in enumerate(members[:size + cycles])),
+                batch_size=5000,
+            )
+
+            latencies, queries = [], []
+            for _ in range(cycles):
+                executed = []
+
+                def count(execute, sql, params, many, context):
+                    # The debug query log is capped, so count statements directly
+                    executed.append(sql)
+                    return execute(sql, params, many, context)
+
+                with connection.execute_wrapper(count), Timer() as timer:
+                    loan = circulation.return_loan(loan)
+                latencies.append(timer.elapsed)
+                queries.append(len(executed))
+                # The member whose hold is ready collects the copy
+                hold = Hold.objects.get(book=book, status=Hold.READY)
+                loan = circulation.issue_loan(book, hold.member)
+
+            self.stdout.write(
+                f'holds={size} cycles={cycles} queries/return={min(queries)}-{max(queries)} latency_ms '
+                + ' '.join(f'{k}={v}' for k, v in percentiles(latencies).items())
+            )
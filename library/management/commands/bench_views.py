@@ -0,0 +1,198 @@
+import json
+import platform
+import random
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import URLPattern, reverse
+
+from library import seed, stats, urls
+from library.benchmarks import Timer, percentiles, scratch_database
+from library.models import Author, Book, Category, Loan, Member
+
+
+def samples():
+    """Representative objects for URL arguments: the busiest book and member"""
+    book = Book.objects.annotate(n=Count('loan')).order_by('-n').first()
+    member = Member.objects.order_by('-total_loan_count').first()
+    author = Author.objects.order_by('pk').first()
+    category = Category.objects.order_by('pk').first()
+    loan = Loan.objects.filter(member=member).order_by('-pk').first()
+    word = book.title.split()[0] if book else 'a'
+    return {
+        'book_detail': {'slug': book.slug},
+        'book_edit': {'slug': book.slug},
+        'member_detail': {'pk': member.pk},
+        'member_fines': {'pk': member.pk},
+        'export_member_history': {'pk': member.pk},
+        'author_edit': {'pk': author.pk},
+        'api_book': {'pk': book.pk},
+        'api_author': {'pk': author.pk},
+        'api_category': {'pk': category.pk},
+        'api_member': {'pk': member.pk},
+        'api_loan': {'pk': loan.pk},
+        'lookup': {'kind': 'author'},
+        # Extra query-string variants of list views, keyed "name?param"
+        'book_list?q': {'q': word},
+        'book_list?category': {'category': book.category.values_list('pk', flat=True).first()},
+        'member_list?q': {'q': member.last_name},
+        'search?q': {'q': word},
+        'search_autocomplete?q': {'q': word[:3]},
+        'api_books?limit': {'limit': 1000},
+        'api_loans?member': {'member': member.pk, 'fields': 'id,book,due_date'},
+    }
+
+
+# Routes that only accept POST; a GET would time the 405 response
+POST_ONLY = {'hold_place', 'hold_cancel'}
+
+
+def targets(arguments):
+    """(report key, url, query params) for every named GET route in library/urls.py"""
+    result = []
+    missing = []
+    for pattern in urls.urlpatterns:
+        if not isinstance(pattern, URLPattern) or not pattern.name or pattern.name in POST_ONLY:
+            continue
+        kwargs = {}
+        if pattern.pattern.converters:
+            if pattern.name not in arguments:
+                missing.append(pattern.name)
+                continue
+            kwargs = arguments[pattern.name]
+        result.append((pattern.name, reverse(pattern.name, kwargs=kwargs), {}))
+    if missing:
+        raise CommandError('No sample URL arguments for: ' + ', '.join(missing))
+    for key, params in arguments.items():
+        if '?' in key:
+            result.append((key, reverse(key.split('?')[0]), params))
+    return result
+
+
+def fetch(client, url, params):
+    response = client.get(url, params)
+    if response.streaming:
+        # Streamed bodies are only produced, and queried for, as they are
+        # read; discard each chunk so the client does not count as the view
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+def measure(client, url, params, requests, warmup=2):
+    for _ in range(warmup):
+        response = fetch(client, url, params)
+    # queries_log is reset on reconnect, so count with a wrapper instead
+    queries = []
+    with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+        fetch(client, url, params)
+    tracemalloc.start()
+    fetch(client, url, params)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    timings = []
+    for _ in range(requests):
+        with Timer() as timer:
+            fetch(client, url, params)
+        timings.append(timer.elapsed)
+    return {
+        'status': response.status_code,
+        'queries': len(queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+        'latency_ms': percentiles(timings),
+    }
+
+
+def run(requests, log=None):
+    client = Client()
+    results = {}
+    for key, url, params in targets(samples()):
+        results[key] = dict(url=url, params=params, **measure(client, url, params, requests))
+        if log:
+            log(key, results[key])
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Seed a scratch database and benchmark every route in library/urls.py, writing a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=0.01, help='Dataset size relative to seed_data --scale 1')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=20, help='Timed requests per view')
+        parser.add_argument('--output', default='bench-views.json', help='Where to write the JSON report')
+        parser.add_argument('--baseline', help='Earlier report to compare against')
+        parser.add_argument('--threshold', type=float, default=1.25, help='p50 ratio reported as a regression')
+
+    def handle(self, *args, **options):
+        size = seed.sizes(options['scale'])
+        setup_test_environment()
+        try:
+            # Measure what production serves, not the debug toolbar
+            with override_settings(DEBUG=False), scratch_database():
+                self.stdout.write('Seeding ' + ', '.join(f'{n} {name}' for name, n in size.items()))
+                seed.seed(rng=random.Random(options['seed']), **size)
+                stats.get_cache().clear()
+                results = run(options['requests'], log=self.log)
+                vendor = connection.vendor
+        finally:
+            teardown_test_environment()
+
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': vendor,
+                'dataset': size,
+                'requests': options['requests'],
+            },
+            'views': results,
+        }
+        with open(options['output'], 'w') as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        if options['baseline']:
+            self.compare(options['baseline'], results, options['threshold'])
+
+    def log(self, key, result):
+        latency = result['latency_ms']
+        self.stdout.write(
+            f"{key:<22} {result['status']} queries={result['queries']:<3} "
+            f"p50={latency['p50']}ms p99={latency['p99']}ms peak={result['peak_memory_kb']}KiB"
+        )
+
+    def compare(self, path, results, threshold):
+        with open(path) as handle:
+            baseline = json.load(handle)['views']
+        regressions = 0
+        for key, result in results.items():
+            before = baseline.get(key)
+            if not before:
+                continue
+            ratio = result['latency_ms']['p50'] / max(before['latency_ms']['p50'], 0.001)
+            more_queries = result['queries'] > before['queries']
+            if ratio > threshold or more_queries:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(
+                    f"{key}: p50 x{ratio:.2f}, queries {before['queries']} -> {result['queries']}"
+                ))
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {path}'))
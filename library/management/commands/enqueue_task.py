@@ -0,0 +1,30 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library import tasks
+
+
+class Command(BaseCommand):
+    help = 'Queue a background task, e.g. from cron: enqueue_task send_due_reminders days=1'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help='One of: ' + ', '.join(sorted(tasks.REGISTRY)))
+        parser.add_argument('kwargs', nargs='*', metavar='key=value', help='Keyword arguments; values are parsed as JSON when they can be')
+        parser.add_argument('--delay', type=int, default=0, help='Seconds to wait before the task may run')
+
+    def handle(self, *args, **options):
+        kwargs = {}
+        for pair in options['kwargs']:
+            key, sep, value = pair.partition('=')
+            if not sep:
+                raise CommandError(f'Expected key=value, got {pair!r}')
+            try:
+                kwargs[key] = json.loads(value)
+            except ValueError:
+                kwargs[key] = value
+        try:
+            task = tasks.enqueue(options['name'], delay=options['delay'], **kwargs)
+        except LookupError as exc:
+            raise CommandError(exc)
+        self.stdout.write(self.style.SUCCESS(f'Queued {task}.'))
@@ -0,0 +1,17 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from library import circulation
+
+
+class Command(BaseCommand):
+    help = 'Expire holds not collected in time and pass their copies to the next holds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, help='Expire as of this date (default: today)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Holds per transaction')
+
+    def handle(self, *args, **options):
+        expired = circulation.expire_holds(options['date'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Expired {expired} hold(s).'))
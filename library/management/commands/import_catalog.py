@@ -0,0 +1,195 @@
+import csv
+import json
+import time
+from datetime import date
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from library import autocomplete, fulltext, stats, versions
+from library.models import Author, Book, Category
+from library.slugs import SlugAllocator
+
+REQUIRED = ('title', 'author', 'isbn', 'publisher', 'published_date', 'total_copies')
+
+
+def read_csv(handle):
+    yield from csv.DictReader(handle)
+
+
+class MalformedRow(ValueError):
+    """A line that could not be parsed, reported like a row that fails validation"""
+
+
+def read_jsonl(handle):
+    for line in handle:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield MalformedRow(f'invalid JSON ({e.msg} at column {e.colno})')
+
+
+def split_categories(value):
+    if isinstance(value, list):
+        return [name.strip() for name in value if name and name.strip()]
+    return [name.strip() for name in (value or '').split('|') if name.strip()]
+
+
+class NameMap:
+    """name -> id lookup that only asks the database about unseen names"""
+
+    def __init__(self, model):
+        self.model = model
+        self.ids = {}
+
+    def resolve(self, names, defaults=None):
+        """Ensure every name has an id; returns the ids of rows it created"""
+        missing = set(names) - self.ids.keys()
+        if not missing:
+            return []
+        self.load(missing)
+        to_create = missing - self.ids.keys()
+        if not to_create:
+            return []
+        defaults = defaults or {}
+        self.model.objects.bulk_create(
+            [self.model(name=name, **defaults.get(name, {})) for name in to_create]
+        )
+        # Re-read rather than trusting bulk_create, which sets no pks on MySQL
+        self.load(to_create)
+        return [self.ids[name] for name in to_create]
+
+    def load(self, names):
+        # Name is not unique, so the oldest row wins, as with get_or_create
+        rows = self.model.objects.filter(name__in=names).order_by('-pk').values_list('name', 'pk')
+        self.ids.update(rows)
+
+
+class Command(BaseCommand):
+    help = 'Stream books from a CSV or JSONL file into the catalog in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV (with a header row) or JSONL file')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows per transaction')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        reader = read_jsonl if fmt == 'jsonl' else read_csv
+        self.authors = NameMap(Author)
+        self.categories = NameMap(Category)
+        self.slugs = SlugAllocator()
+        self.counts = {'created': 0, 'skipped': 0, 'invalid': 0}
+
+        start = time.perf_counter()
+        try:
+            with open(path, newline='', encoding='utf-8') as handle:
+                rows = reader(handle)
+                line = 1
+                while True:
+                    chunk = list(islice(rows, options['chunk_size']))
+                    if not chunk:
+                        break
+                    self.import_chunk(chunk, line)
+                    line += len(chunk)
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(f'{line - 1} rows read, {(line - 1) / elapsed:.0f} rows/s', ending='\r')
+        except OSError as e:
+            raise CommandError(e)
+        finally:
+            stats.invalidate('total_books', 'activity')
+            versions.bump('book', 'author', 'category')
+            # The bumps are this process's own, so they would not trigger a rebuild
+            autocomplete.index.clear()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.counts['created']} books in {elapsed:.1f}s "
+            f"({self.counts['skipped']} already present, {self.counts['invalid']} invalid)."
+        ))
+
+    def clean(self, row, line):
+        try:
+            if isinstance(row, MalformedRow):
+                raise row
+            if not isinstance(row, dict):
+                raise ValueError('not a JSON object')
+            missing = [field for field in REQUIRED if not str(row.get(field) or '').strip()]
+            if missing:
+                raise ValueError('missing ' + ', '.join(missing))
+            total = int(row['total_copies'])
+            available = row.get('available_copies')
+            available = total if available in (None, '') else int(available)
+            if not 0 <= available <= total:
+                raise ValueError('available_copies must be between 0 and total_copies')
+            return {
+                'title': row['title'].strip(),
+                'author': row['author'].strip(),
+                'biography': (row.get('author_biography') or '').strip(),
+                'isbn': str(row['isbn']).strip(),
+                'categories': split_categories(row.get('categories')),
+                'publisher': row['publisher'].strip(),
+                'published_date': date.fromisoformat(str(row['published_date']).strip()),
+                'total_copies': total,
+                'available_copies': available,
+            }
+        except (ValueError, TypeError, AttributeError) as e:
+            self.counts['invalid'] += 1
+            self.stderr.write(f'Row {line}: {e}')
+            return None
+
+    def import_chunk(self, chunk, first_line):
+        rows = {}
+        for offset, raw in enumerate(chunk):
+            row = self.clean(raw, first_line + offset)
+            if row is None:
+                continue
+            if row['isbn'] in rows:
+                self.counts['skipped'] += 1
+            else:
+                rows[row['isbn']] = row
+        existing = set(Book.objects.filter(isbn__in=rows).values_list('isbn', flat=True))
+        self.counts['skipped'] += len(existing)
+        rows = [row for isbn, row in rows.items() if isbn not in existing]
+        if not rows:
+            return
+
+        with transaction.atomic():
+            new_authors = self.authors.resolve(
+                {row['author'] for row in rows},
+                defaults={row['author']: {'biography': row['biography']} for row in rows if row['biography']},
+            )
+            self.categories.resolve({name for row in rows for name in row['categories']})
+            slugs = self.slugs.allocate([row['title'] for row in rows])
+
+            Book.objects.bulk_create([
+                Book(
+                    title=row['title'],
+                    slug=slug,
+                    author_id=self.authors.ids[row['author']],
+                    isbn=row['isbn'],
+                    publisher=row['publisher'],
+                    published_date=row['published_date'],
+                    total_copies=row['total_copies'],
+                    available_copies=row['available_copies'],
+                )
+                for row, slug in zip(rows, slugs)
+            ])
+            book_ids = dict(Book.objects.filter(isbn__in=[row['isbn'] for row in rows]).values_list('isbn', 'pk'))
+
+            Through = Book.category.through
+            Through.objects.bulk_create([
+                Through(book_id=book_ids[row['isbn']], category_id=self.categories.ids[name])
+                for row in rows
+                for name in set(row['categories'])
+            ], ignore_conflicts=True)
+
+            # bulk_create skips post_save, so feed the search index directly
+            fulltext.index_objects(Author, new_authors)
+            fulltext.index_objects(Book, book_ids.values())
+
+        self.counts['created'] += len(rows)
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template import engines
+from django.template.backends.jinja2 import Jinja2
+from jinja2 import TemplateSyntaxError
+
+
+class Command(BaseCommand):
+    help = (
+        'Compile every Jinja2 template into the bytecode cache so fresh workers skip compilation. '
+        'Run it at build time, from the same path the application is served from.'
+    )
+
+    def handle(self, *args, **options):
+        compiled = 0
+        errors = []
+        start = time.perf_counter()
+        for engine in engines.all():
+            if not isinstance(engine, Jinja2):
+                continue
+            env = engine.env
+            if env.bytecode_cache is None:
+                raise CommandError(
+                    'No bytecode cache is configured; set LIBRARY_TEMPLATE_BYTECODE_DIR '
+                    'or LIBRARY_TEMPLATE_BYTECODE_CACHE.'
+                )
+            for name in env.list_templates(filter_func=lambda name: not name.startswith('.')):
+                try:
+                    # Loading compiles the source and stores the bytecode
+                    env.get_template(name)
+                except TemplateSyntaxError as e:
+                    errors.append(f'{name}:{e.lineno}: {e.message}')
+                else:
+                    compiled += 1
+
+        for error in errors:
+            self.stderr.write(error)
+        elapsed = time.perf_counter() - start
+        if errors:
+            raise CommandError(f'{len(errors)} templates failed to compile.')
+        self.stdout.write(self.style.SUCCESS(f'Compiled {compiled} templates in {elapsed:.2f}s.'))
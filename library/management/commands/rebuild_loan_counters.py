@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from library.fines import unpaid_total
+from library.models import Loan, Member
+
+
+def loan_count(**filters):
+    counts = (
+        Loan.objects.filter(member=OuterRef('pk'), **filters)
+        .order_by()
+        .values('member')
+        .annotate(n=Count('pk'))
+        .values('n')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+class Command(BaseCommand):
+    help = 'Recompute the maintained Member columns (loan counts, fine balance) from the loan and fine tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Members updated per statement (keeps each transaction short)',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = Member.objects.aggregate(last=Max('pk'))['last'] or 0
+        updated = 0
+        # Walk the primary key range so each UPDATE touches a bounded slice
+        for start in range(0, last_id + 1, chunk_size):
+            with transaction.atomic():
+                updated += Member.objects.filter(pk__gte=start, pk__lt=start + chunk_size).update(
+                    active_loan_count=loan_count(return_date__isnull=True),
+                    total_loan_count=loan_count(),
+                    fine_balance=unpaid_total(),
+                )
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt loan counters and fine balances for {updated} members.'))
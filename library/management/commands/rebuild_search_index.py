@@ -0,0 +1,19 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from library import fulltext
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for books, authors and members'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        backend = fulltext.backend_for(options['database'])
+        for kind in fulltext.INDEXES:
+            backend.create_schema(kind)
+        fulltext.rebuild(apps, using=options['database'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt.'))
@@ -0,0 +1,36 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library import inventory
+
+
+class Command(BaseCommand):
+    help = 'Compare available copies with total copies less open loans and ready holds, optionally repairing drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='Set drifted books to their expected available copies')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Book ids per query')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint of an interrupted run and start over')
+        parser.add_argument('--report', metavar='PATH', help='Write the drifted books to this CSV file')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        if not options['report']:
+            return self.run(options)
+        with open(options['report'], 'w', newline='') as output:
+            writer = csv.writer(output)
+            writer.writerow(inventory.Drift._fields + ('drift',))
+            self.run(options, lambda row: writer.writerow(row + (row.available_copies - row.expected,)))
+
+    def run(self, options, report=None):
+        checked, drifted, repaired = inventory.reconcile(
+            fix=options['repair'], chunk_size=options['chunk_size'],
+            resume=not options['restart'], report=report,
+        )
+        summary = f'Checked {checked} books: {drifted} drifted'
+        if options['repair']:
+            summary += f', {repaired} repaired'
+        style = self.style.WARNING if drifted and not options['repair'] else self.style.SUCCESS
+        self.stdout.write(style(summary + '.'))
@@ -0,0 +1,81 @@
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from library.concurrency import init_worker
+
+# Model-dependent imports are deferred: pool workers are spawned fresh and
+# load this module before django.setup() has run in them.
+
+
+def run_task(task_id):
+    from library import tasks
+    try:
+        return tasks.execute(task_id)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks until stopped, or until the queue is empty with --once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.LIBRARY_TASK_WORKERS, help='Tasks run at the same time')
+        parser.add_argument('--processes', action='store_true', help='Run tasks in worker processes rather than threads')
+        parser.add_argument('--once', action='store_true', help='Exit once no task is due')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds between checks of an idle queue')
+
+    def handle(self, *args, **options):
+        from library import tasks
+
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError('--workers must be at least 1')
+        if workers == 1:
+            # Run in this thread, one task at a time
+            ok = failed = 0
+            while True:
+                ids = tasks.claim(1)
+                if not ids:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+                if tasks.execute(ids[0]):
+                    ok += 1
+                else:
+                    failed += 1
+            self.report(ok, failed)
+            return
+
+        if options['processes']:
+            # Children must not inherit this process's open connections
+            connections.close_all()
+            pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=init_worker)
+        else:
+            pool = ThreadPoolExecutor(workers)
+        ok = failed = 0
+        running = set()
+        with pool:
+            while True:
+                ids = tasks.claim(workers - len(running)) if len(running) < workers else []
+                running.update(pool.submit(run_task, task_id) for task_id in ids)
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+                done, running = wait(running, timeout=options['poll'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.result():
+                        ok += 1
+                    else:
+                        failed += 1
+        self.report(ok, failed)
+
+    def report(self, ok, failed):
+        self.stdout.write(self.style.SUCCESS(f'Ran {ok + failed} tasks: {ok} succeeded, {failed} failed or will be retried.'))
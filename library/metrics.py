@@ -0,0 +1,140 @@
+"""In-process request metrics in the Prometheus text format.
+
+``library.middleware.RequestMetricsMiddleware`` records, per URL name, how
+long each request took, how many SQL queries it ran and how long they took,
+and how long Jinja2 spent rendering. ``metrics_view`` serves the totals for
+Prometheus to scrape.
+
+Everything is kept in plain dicts behind one lock, so recording a request
+costs a handful of ``bisect`` calls. Each server process keeps its own
+numbers; Prometheus sums them across scrape targets.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.http import HttpResponse
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Request being measured in the current thread or task
+current = ContextVar('library_request_metrics', default=None)
+
+
+class Histogram:
+    def __init__(self, name, help, buckets, label='view'):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.label = label
+        self.series = {}
+
+    def observe(self, label, value):
+        counts = self.series.get(label)
+        if counts is None:
+            # One count per bucket, then +Inf, sum and count
+            counts = self.series[label] = [0] * (len(self.buckets) + 1) + [0, 0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def expose(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for label, counts in sorted(self.series.items()):
+            labels = f'{self.label}="{escape(label)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+            yield f'{self.name}_sum{{{labels}}} {counts[-2]}'
+            yield f'{self.name}_count{{{labels}}} {counts[-1]}'
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, *values):
+        self.series[values] = self.series.get(values, 0) + 1
+
+    def expose(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for values, count in sorted(self.series.items()):
+            labels = ','.join(f'{name}="{escape(value)}"' for name, value in zip(self.labels, values))
+            yield f'{self.name}{{{labels}}} {count}'
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+lock = threading.Lock()
+requests_total = Counter('library_requests_total', 'Requests by URL name and status code.', ('view', 'status'))
+request_duration = Histogram('library_request_duration_seconds', 'Request latency.', SECONDS_BUCKETS)
+sql_queries = Histogram('library_request_sql_queries', 'SQL queries per request.', QUERY_BUCKETS)
+sql_duration = Histogram('library_request_sql_duration_seconds', 'Time spent in SQL per request.', SECONDS_BUCKETS)
+render_duration = Histogram('library_request_render_duration_seconds', 'Time spent rendering Jinja2 templates per request.', SECONDS_BUCKETS)
+ALL = (requests_total, request_duration, sql_queries, sql_duration, render_duration)
+
+
+class RequestStats:
+    """Running totals for one request, filled in by the hooks below"""
+    __slots__ = ('queries', 'sql_time', 'render_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+
+
+def record(view, status, duration, request_stats):
+    with lock:
+        requests_total.inc(view, str(status))
+        request_duration.observe(view, duration)
+        sql_queries.observe(view, request_stats.queries)
+        sql_duration.observe(view, request_stats.sql_time)
+        render_duration.observe(view, request_stats.render_time)
+
+
+def reset():
+    with lock:
+        for metric in ALL:
+            metric.series.clear()
+
+
+def expose():
+    with lock:
+        lines = [line for metric in ALL for line in metric.expose()]
+    return '\n'.join(lines) + '\n'
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    """``connection.execute_wrapper`` hook that times every query"""
+    request_stats = current.get()
+    if request_stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_stats.sql_time += time.perf_counter() - start
+        request_stats.queries += 1
+
+
+def add_render_time(seconds):
+    request_stats = current.get()
+    if request_stats is not None:
+        request_stats.render_time += seconds
+
+
+def metrics_view(request):
+    return HttpResponse(expose(), content_type=CONTENT_TYPE)
@@ -0,0 +1,110 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics, routers
+
+
+class RequestMetricsMiddleware:
+    """Record latency, SQL and template cost of every request by URL name.
+
+    SQL is timed by ``metrics.sql_wrapper``, which library.signals installs
+    on every connection so queries run from async views' thread pools count
+    toward the request that started them.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_stats = metrics.RequestStats()
+        token = metrics.current.set(request_stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        self.record(request, response, time.perf_counter() - start, request_stats)
+        return response
+
+    async def __acall__(self, request):
+        request_stats = metrics.RequestStats()
+        token = metrics.current.set(request_stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        self.record(request, response, time.perf_counter() - start, request_stats)
+        return response
+
+    def record(self, request, response, duration, request_stats):
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        # Scrapes would otherwise dominate the numbers they report
+        if view != 'metrics':
+            metrics.record(view, response.status_code, duration, request_stats)
+
+
+class ReplicaRoutingMiddleware:
+    """Per-request state for ``library.routers.ReplicaRouter``.
+
+    Views marked ``replica_reads`` read from a replica for GET and HEAD
+    unless the browser wrote recently. When a request writes, the response
+    sets a cookie that keeps the browser on the primary until the replicas
+    have caught up.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        routing = routers.RequestRouting()
+        token = routers.current.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.current.reset(token)
+        return self.stick(routing, response)
+
+    async def __acall__(self, request):
+        routing = routers.RequestRouting()
+        token = routers.current.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.current.reset(token)
+        return self.stick(routing, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        routing = routers.current.get()
+        if (
+            routing is not None
+            and getattr(view_func, 'replica_reads', False)
+            and request.method in ('GET', 'HEAD')
+            and routers.STICKY_COOKIE not in request.COOKIES
+        ):
+            # One replica for the whole request, so the page shows one snapshot
+            routing.replica = routers.pick_replica()
+
+    def stick(self, routing, response):
+        if routing.wrote and routers.replicas():
+            response.set_cookie(
+                routers.STICKY_COOKIE, '1',
+                max_age=getattr(settings, 'LIBRARY_REPLICA_STICKY_SECONDS', 10),
+                httponly=True, samesite='Lax',
+            )
+        return response
@@ -0,0 +1,75 @@
+from django.db import migrations
+
+# The index tables as library.fulltext created them when this migration was
+# written; later changes to that module get migrations of their own
+KINDS = ('book', 'author', 'member')
+
+CREATE = {
+    'sqlite': (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS library_search_{kind} USING fts5("
+        "body, tokenize = 'unicode61 remove_diacritics 2')"
+    ),
+    'mysql': (
+        'CREATE TABLE IF NOT EXISTS library_search_{kind} ('
+        'object_id BIGINT NOT NULL PRIMARY KEY, '
+        'body LONGTEXT NOT NULL, '
+        'FULLTEXT KEY library_search_{kind}_body (body)'
+        ') ENGINE=InnoDB DEFAULT CHARSET=utf8mb4'
+    ),
+}
+INSERT = {
+    'sqlite': 'INSERT INTO library_search_{kind} (rowid, body) VALUES (%s, %s)',
+    'mysql': 'INSERT INTO library_search_{kind} (object_id, body) VALUES (%s, %s)',
+}
+CHUNK_SIZE = 2000
+
+
+def documents(apps, kind, using):
+    if kind == 'book':
+        books = apps.get_model('library', 'Book')._default_manager.using(using).select_related('author')
+        for book in books.order_by('pk').iterator(chunk_size=CHUNK_SIZE):
+            yield book.pk, ' '.join([book.title, book.author.name, book.isbn, book.isbn.replace('-', '')])
+    elif kind == 'author':
+        authors = apps.get_model('library', 'Author')._default_manager.using(using)
+        yield from authors.order_by('pk').values_list('pk', 'name').iterator(chunk_size=CHUNK_SIZE)
+    else:
+        members = apps.get_model('library', 'Member')._default_manager.using(using)
+        for pk, first_name, last_name, email in (
+            members.order_by('pk').values_list('pk', 'first_name', 'last_name', 'email').iterator(chunk_size=CHUNK_SIZE)
+        ):
+            yield pk, ' '.join([first_name, last_name, email])
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor not in CREATE:
+        # Other databases need LIBRARY_SEARCH_BACKEND and `manage.py rebuild_search_index`
+        return
+    with connection.cursor() as cursor:
+        for kind in KINDS:
+            cursor.execute(CREATE[connection.vendor].format(kind=kind))
+            batch = []
+            for document in documents(apps, kind, connection.alias):
+                batch.append(document)
+                if len(batch) >= CHUNK_SIZE:
+                    cursor.executemany(INSERT[connection.vendor].format(kind=kind), batch)
+                    batch = []
+            if batch:
+                cursor.executemany(INSERT[connection.vendor].format(kind=kind), batch)
+
+
+def drop_search_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for kind in KINDS:
+            cursor.execute('DROP TABLE IF EXISTS library_search_%s' % kind)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0002_book_slug'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def loan_count(Loan, **filters):
+    counts = (
+        Loan.objects.filter(member=OuterRef('pk'), **filters)
+        .order_by()
+        .values('member')
+        .annotate(n=Count('pk'))
+        .values('n')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def fill_loan_counts(apps, schema_editor):
+    Member = apps.get_model('library', 'Member')
+    Loan = apps.get_model('library', 'Loan')
+    Member.objects.update(
+        active_loan_count=loan_count(Loan, return_date__isnull=True),
+        total_loan_count=loan_count(Loan),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0003_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='member',
+            name='active_loan_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='member',
+            name='total_loan_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_loan_counts, migrations.RunPython.noop),
+    ]
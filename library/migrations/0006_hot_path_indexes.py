@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-17 06:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_jobcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['title', 'id'], name='book_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fine',
+            index=models.Index(fields=['loan', 'paid'], name='fine_loan_paid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['return_date', 'due_date'], name='loan_open_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['member', 'return_date'], name='loan_member_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['member', 'issue_date'], name='loan_member_issued_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['book', 'issue_date'], name='loan_book_issued_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['issue_date'], name='loan_issued_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['last_name', 'first_name', 'id'], name='member_name_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-17 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0006_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('version', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+    ]
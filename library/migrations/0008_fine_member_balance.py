@@ -0,0 +1,57 @@
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import DecimalField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_fine_members(apps, schema_editor):
+    Fine = apps.get_model('library', 'Fine')
+    Loan = apps.get_model('library', 'Loan')
+    Fine.objects.update(member=Subquery(Loan.objects.filter(pk=OuterRef('loan_id')).values('member_id')[:1]))
+
+
+def fill_fine_balances(apps, schema_editor):
+    Member = apps.get_model('library', 'Member')
+    Fine = apps.get_model('library', 'Fine')
+    totals = (
+        Fine.objects.filter(member=OuterRef('pk'), paid=False)
+        .order_by()
+        .values('member')
+        .annotate(total=Sum('amount'))
+        .values('total')
+    )
+    field = DecimalField(max_digits=10, decimal_places=2)
+    Member.objects.update(fine_balance=Coalesce(Subquery(totals, output_field=field), Decimal('0'), output_field=field))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0007_contentversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fine',
+            name='member',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='library.member'),
+        ),
+        migrations.RunPython(fill_fine_members, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='fine',
+            name='member',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='library.member'),
+        ),
+        migrations.AddIndex(
+            model_name='fine',
+            index=models.Index(fields=['member', 'paid'], name='fine_member_paid_idx'),
+        ),
+        migrations.AddField(
+            model_name='member',
+            name='fine_balance',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.RunPython(fill_fine_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:02
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+# Windows and checkpoint as library.popularity defined them when this
+# migration was written; all time is stored as window 0
+WINDOWS = (7, 30, 365, 0)
+CHECKPOINT = 'popularity:rolled'
+BATCH_SIZE = 5000
+
+
+def backfill(apps, schema_editor):
+    using = schema_editor.connection.alias
+    Loan = apps.get_model('library', 'Loan')
+    Daily = apps.get_model('library', 'BookDailyLoans')
+    Totals = apps.get_model('library', 'BookPopularity')
+    JobCheckpoint = apps.get_model('library', 'JobCheckpoint')
+    today = timezone.localdate()
+
+    counts = (
+        Loan._default_manager.using(using).order_by()
+        .values_list('book_id', 'issue_date').annotate(n=Count('pk'))
+    )
+    Daily._default_manager.using(using).bulk_create(
+        (Daily(book_id=book_id, day=day, loans=n) for book_id, day, n in counts.iterator(chunk_size=BATCH_SIZE)),
+        batch_size=BATCH_SIZE,
+    )
+    for window in WINDOWS:
+        rows = Daily._default_manager.using(using).all()
+        if window:
+            rows = rows.filter(day__gt=today - timedelta(days=window))
+        sums = rows.order_by().values_list('book_id').annotate(total=Sum('loans'))
+        Totals._default_manager.using(using).bulk_create(
+            (Totals(book_id=book_id, window=window, loans=total) for book_id, total in sums.iterator(chunk_size=BATCH_SIZE)),
+            batch_size=BATCH_SIZE,
+        )
+    JobCheckpoint._default_manager.using(using).update_or_create(
+        name=CHECKPOINT, defaults={'position': today.toordinal()}
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0008_fine_member_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookDailyLoans',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('loans', models.PositiveIntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='library.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day', 'book', 'loans'], name='daily_loans_window_idx')],
+                'constraints': [models.UniqueConstraint(fields=('book', 'day'), name='daily_loans_book_day_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='BookPopularity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.PositiveSmallIntegerField()),
+                ('loans', models.PositiveIntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='library.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['window', 'loans', 'book'], name='popularity_rank_idx')],
+                'constraints': [models.UniqueConstraint(fields=('window', 'book'), name='popularity_window_book_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_popularity'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['name', 'id'], name='author_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['name', 'id'], name='category_name_idx'),
+        ),
+    ]
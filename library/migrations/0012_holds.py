@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0011_task_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Hold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority', models.SmallIntegerField(default=0)),
+                ('status', models.CharField(choices=[('waiting', 'Waiting'), ('ready', 'Ready for pickup'), ('fulfilled', 'Fulfilled'), ('cancelled', 'Cancelled'), ('expired', 'Expired')], default='waiting', max_length=10)),
+                ('placed_at', models.DateTimeField(auto_now_add=True)),
+                ('ready_on', models.DateField(blank=True, null=True)),
+                ('expires_on', models.DateField(blank=True, null=True)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='library.book')),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='library.member')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['book', 'status', '-priority', 'id'], name='hold_queue_idx'), models.Index(fields=['status', 'expires_on'], name='hold_expiry_idx'), models.Index(fields=['member', 'status'], name='hold_member_idx')],
+            },
+        ),
+    ]
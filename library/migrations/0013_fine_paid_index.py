@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0012_holds'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fine',
+            index=models.Index(fields=['paid', 'id'], name='fine_paid_idx'),
+        ),
+    ]
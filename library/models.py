@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 class Book(models.Model):
@@ -12,6 +13,12 @@ class Book(models.Model):
     total_copies = models.PositiveIntegerField()
     available_copies = models.PositiveIntegerField()
 
+    class Meta:
+        indexes = [
+            # book_list pages on (title, id)
+            models.Index(fields=['title', 'id'], name='book_title_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -19,12 +26,24 @@ class Author(models.Model):
     name = models.CharField(max_length=100)
     biography = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            # Author lookups and author_list page on (name, id)
+            models.Index(fields=['name', 'id'], name='author_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
     
 class Category(models.Model):
     name = models.CharField(max_length=100)
 
+    class Meta:
+        indexes = [
+            # Category lookups on (name, id)
+            models.Index(fields=['name', 'id'], name='category_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
     
@@ -35,6 +54,17 @@ class Member(models.Model):
     phone_number = models.CharField(max_length=15, blank=True)
     address = models.TextField(blank=True)
     join_date = models.DateField(auto_now_add=True)
+    # Maintained by library.signals, rebuilt by `manage.py rebuild_loan_counters`
+    active_loan_count = models.PositiveIntegerField(default=0, editable=False)
+    total_loan_count = models.PositiveIntegerField(default=0, editable=False)
+    # Sum of unpaid fines, maintained by library.fines
+    fine_balance = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # member_list pages on (last_name, first_name, id)
+            models.Index(fields=['last_name', 'first_name', 'id'], name='member_name_idx'),
+        ]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
@@ -45,14 +75,185 @@ class Loan(models.Model):
     issue_date = models.DateField(auto_now_add=True)
     return_date = models.DateField(null=True, blank=True)
     due_date = models.DateField()
+    # Day a due-date reminder went out, see library.reminders
+    reminded_on = models.DateField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Active and overdue loans: dashboard, loan_list, overdue_loans, fines
+            models.Index(fields=['return_date', 'due_date'], name='loan_open_due_idx'),
+            # member_detail: open loans and newest-first history
+            models.Index(fields=['member', 'return_date'], name='loan_member_open_idx'),
+            models.Index(fields=['member', 'issue_date'], name='loan_member_issued_idx'),
+            # book_detail: newest-first history
+            models.Index(fields=['book', 'issue_date'], name='loan_book_issued_idx'),
+            # Dashboard recent loans
+            models.Index(fields=['issue_date'], name='loan_issued_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so a later save can tell whether the loan was just returned
+        instance._loaded_return_date = instance.__dict__.get('return_date')
+        return instance
 
     def __str__(self):
         return f"{self.book.title} loaned to {self.member.first_name} {self.member.last_name}"
     
 class Fine(models.Model):
     loan = models.ForeignKey(Loan, on_delete=models.CASCADE)
+    # Copied from the loan so a member's fines are found without a join
+    member = models.ForeignKey(Member, on_delete=models.CASCADE, editable=False)
     amount = models.DecimalField(max_digits=6, decimal_places=2)
     paid = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['loan', 'paid'], name='fine_loan_paid_idx'),
+            # Unpaid fines of a member; the ledger pages on the member index
+            models.Index(fields=['member', 'paid'], name='fine_member_paid_idx'),
+            # The admin's paid filter, newest first
+            models.Index(fields=['paid', 'id'], name='fine_paid_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.member_id is None:
+            self.member_id = Loan.objects.values_list('member_id', flat=True).get(pk=self.loan_id)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        # Ids rather than names, so listing fines does not look up each member
+        return f"Fine #{self.pk} on loan #{self.loan_id}: ${self.amount}"
+
+
+class JobCheckpoint(models.Model):
+    """Resume position of a long-running batch job, keyed by job name"""
+    name = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
+class ContentVersion(models.Model):
+    """Change counter for a model ("book") or one object ("book:42"), see library.versions"""
+    key = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.key} v{self.version}"
+
+
+class BookDailyLoans(models.Model):
+    """Loans of one book issued on one day, see library.popularity"""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    day = models.DateField()
+    loans = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'day'], name='daily_loans_book_day_uniq'),
+        ]
+        indexes = [
+            # Window totals read (day, book, loans) straight from the index
+            models.Index(fields=['day', 'book', 'loans'], name='daily_loans_window_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id} on {self.day}: {self.loans}"
+
+
+class BookPopularity(models.Model):
+    """Loans of one book over the last ``window`` days (0: all time), see library.popularity"""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    window = models.PositiveSmallIntegerField()
+    loans = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['window', 'book'], name='popularity_window_book_uniq'),
+        ]
+        indexes = [
+            # Top-N reads the window's rows in loan order and stops after N
+            models.Index(fields=['window', 'loans', 'book'], name='popularity_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id} over {self.window or 'all'} days: {self.loans}"
+
+
+class Task(models.Model):
+    """Deferred unit of work run by `manage.py run_tasks`, see library.tasks"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim due tasks in (run_after, id) order
+            models.Index(fields=['status', 'run_after', 'id'], name='task_due_idx'),
+            # Running tasks per name, for concurrency limits and expired leases
+            models.Index(fields=['status', 'name'], name='task_status_name_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+
+class Hold(models.Model):
+    """A member's place in the queue for a book, see library.circulation"""
+    WAITING = 'waiting'
+    READY = 'ready'
+    FULFILLED = 'fulfilled'
+    CANCELLED = 'cancelled'
+    EXPIRED = 'expired'
+    STATUS_CHOICES = [
+        (WAITING, 'Waiting'),
+        (READY, 'Ready for pickup'),
+        (FULFILLED, 'Fulfilled'),
+        (CANCELLED, 'Cancelled'),
+        (EXPIRED, 'Expired'),
+    ]
+    ACTIVE = (WAITING, READY)
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    member = models.ForeignKey(Member, on_delete=models.CASCADE)
+    # Higher priorities are served first, then first come first served
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=WAITING)
+    placed_at = models.DateTimeField(auto_now_add=True)
+    ready_on = models.DateField(null=True, blank=True)
+    expires_on = models.DateField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Next hold for a book: the first entry of its (status, -priority, id) range
+            models.Index(fields=['book', 'status', '-priority', 'id'], name='hold_queue_idx'),
+            # Ready holds past their pickup date, for expire_holds
+            models.Index(fields=['status', 'expires_on'], name='hold_expiry_idx'),
+            # Issuing checks for a hold set aside for the borrower
+            models.Index(fields=['member', 'status'], name='hold_member_idx'),
+        ]
+
     def __str__(self):
-        return f"Fine for {self.loan.member.first_name} {self.loan.member.last_name}: ${self.amount}"
+        return f"Hold #{self.pk} on book #{self.book_id} for member #{self.member_id} ({self.status})"
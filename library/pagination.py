@@ -0,0 +1,262 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values):
+    """Turn a tuple of ordering values into an opaque URL-safe token"""
+    raw = json.dumps(values, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    padding = '=' * (-len(token) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + padding))
+    except (ValueError, TypeError):
+        raise InvalidCursor(token)
+    if not isinstance(values, list):
+        raise InvalidCursor(token)
+    return values
+
+
+class KeysetPage:
+    """One page of a keyset-paginated queryset.
+
+    Mirrors the parts of django.core.paginator.Page the templates use, but
+    instead of page numbers it carries the cursors of its first and last rows.
+    """
+
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetStream:
+    """Forward page that is read lazily with ``QuerySet.iterator``.
+
+    ``next_cursor`` is only known once iteration has finished, so callers
+    that stream rows out emit it last.
+    """
+
+    def __init__(self, paginator, queryset, chunk_size):
+        self.paginator = paginator
+        self.queryset = queryset
+        self.chunk_size = chunk_size
+        self.next_cursor = None
+
+    def __iter__(self):
+        per_page = self.paginator.per_page
+        last = None
+        for count, obj in enumerate(self.queryset[:per_page + 1].iterator(chunk_size=self.chunk_size)):
+            if count == per_page:
+                self.next_cursor = self.paginator._position(last)
+                break
+            last = obj
+            yield obj
+
+
+class KeysetPaginator:
+    """Seek-method paginator over a stable, unique ordering.
+
+    ``ordering`` must end in a unique column (usually ``id``) so that every
+    row has a distinct position, e.g. ``('title', 'id')`` or
+    ``('-due_date', 'id')``. Each page is fetched with a
+    ``WHERE (a, b) > (x, y) ... LIMIT n`` style filter, so the cost of a page
+    depends only on the page size and not on how deep into the list it is.
+    """
+
+    def __init__(self, queryset, ordering, per_page=25):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.descending = [name.startswith('-') for name in self.ordering]
+
+    def _position(self, obj):
+        values = []
+        for name in self.fields:
+            value = obj
+            for part in name.split('__'):
+                value = getattr(value, part)
+            if hasattr(value, 'pk'):
+                value = value.pk
+            values.append(value)
+        return encode_cursor(values)
+
+    def _to_python(self, values):
+        if len(values) != len(self.fields):
+            raise InvalidCursor(values)
+        model = self.queryset.model
+        converted = []
+        for name, value in zip(self.fields, values):
+            field = model._meta.pk if name == 'pk' else None
+            if field is None:
+                opts = model._meta
+                for part in name.split('__'):
+                    field = opts.get_field(part)
+                    if field.is_relation:
+                        opts = field.related_model._meta
+                if field.is_relation:
+                    field = field.target_field
+            # _seek compares with < and >, which cannot be done against NULL
+            if value is None:
+                raise InvalidCursor(values)
+            try:
+                converted.append(field.to_python(value))
+            except (ValidationError, TypeError, ValueError):
+                raise InvalidCursor(values)
+        return converted
+
+    def _seek(self, values, backwards):
+        # Build (a > x) OR (a = x AND b > y) OR ... for the given direction
+        condition = Q()
+        for i, name in enumerate(self.fields):
+            after = self.descending[i] == backwards
+            lookup = '%s__%s' % (name, 'gt' if after else 'lt')
+            term = Q(**{lookup: values[i]})
+            for prev_name, prev_value in zip(self.fields[:i], values[:i]):
+                term &= Q(**{prev_name: prev_value})
+            condition |= term
+        return condition
+
+    def _order_by(self, backwards):
+        if not backwards:
+            return self.ordering
+        return tuple(
+            name[1:] if name.startswith('-') else '-' + name
+            for name in self.ordering
+        )
+
+    def page(self, after=None, before=None):
+        backwards = bool(before) and not after
+        cursor = after or before
+        queryset = self.queryset.order_by(*self._order_by(backwards))
+        if cursor:
+            values = self._to_python(decode_cursor(cursor))
+            queryset = queryset.filter(self._seek(values, backwards))
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        if not rows:
+            return KeysetPage(rows)
+
+        if backwards:
+            next_cursor = self._position(rows[-1])
+            prev_cursor = self._position(rows[0]) if has_more else None
+        else:
+            next_cursor = self._position(rows[-1]) if has_more else None
+            prev_cursor = self._position(rows[0]) if cursor else None
+        return KeysetPage(rows, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+    def stream(self, after=None, chunk_size=500):
+        """Like ``page(after=...)`` but without holding the rows in memory"""
+        queryset = self.queryset.order_by(*self.ordering)
+        if after:
+            queryset = queryset.filter(self._seek(self._to_python(decode_cursor(after)), False))
+        return KeysetStream(self, queryset, chunk_size)
+
+    def batches(self, *fields):
+        """Every row as ``values(*fields)`` dicts, ``per_page`` rows per query.
+
+        Each batch seeks past the last row of the one before, so no query
+        returns more than one batch. Memory stays flat however many rows
+        there are, even on MySQL, whose driver reads a whole result set
+        before ``iterator()`` sees the first row.
+        """
+        names = tuple(fields) + tuple(name for name in self.fields if name not in fields)
+        queryset = self.queryset.order_by(*self.ordering).values(*names)
+        batch = queryset
+        while True:
+            rows = list(batch[:self.per_page])
+            if rows:
+                yield rows
+            if len(rows) < self.per_page:
+                return
+            batch = queryset.filter(self._seek([rows[-1][name] for name in self.fields], False))
+
+
+def paginate(request, queryset, ordering, per_page=25):
+    """Return the KeysetPage selected by the ``after``/``before`` GET params"""
+    paginator = KeysetPaginator(queryset, ordering, per_page=per_page)
+    try:
+        return paginator.page(
+            after=request.GET.get('after'),
+            before=request.GET.get('before'),
+        )
+    except InvalidCursor:
+        return paginator.page()
+
+
+def estimated_rows(model, using='default'):
+    """The row count the database keeps in its table statistics, or None.
+
+    Cheap but approximate: InnoDB samples it and may be off by a large
+    fraction. Backends without such statistics return None.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+                [table],
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator for the admin that skips ``COUNT(*)`` on big unfiltered tables.
+
+    An unfiltered list takes its count from the table statistics once they
+    report at least ``exact_below`` rows; smaller tables and filtered or
+    searched lists are counted exactly.
+    """
+
+    exact_below = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.exact_below:
+                return estimate
+        return super().count
@@ -0,0 +1,204 @@
+"""Most borrowed books over the last 7, 30 or 365 days, or all time.
+
+Two tables back the rankings:
+
+- ``BookDailyLoans`` counts the loans issued per book per day.
+- ``BookPopularity`` holds each book's total for each window. A top-N
+  list reads the first N entries of the ``(window, loans, book)`` index,
+  so it costs the same however long the loan history is.
+
+Issuing a loan adds one to the book's row for its day and to its total in
+every window that covers that day, in the loan's transaction (see
+``library.signals``). Once a day the 7, 30 and 365 day windows move
+forward: ``roll`` subtracts the days that dropped out of each one, grouped
+by count as in ``library.fines``. It runs from a nightly
+``manage.py backfill_popularity --roll`` or the ``roll_popularity`` task,
+never in a request. Until the totals have been rolled through today,
+``top_books`` sums the daily rows instead, so a ranking is never out of
+date.
+
+``rebuild`` recomputes both tables from the loan table, for bulk imports
+and the initial backfill.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.utils import timezone
+
+from . import tasks
+from .models import Book, BookDailyLoans, BookPopularity, JobCheckpoint
+
+# Choices offered by the popular books page, in days; None is all time
+WINDOWS = {'7': 7, '30': 30, '365': 365, 'all': None}
+# BookPopularity.window values; all time is stored as 0
+TOTALS = (7, 30, 365, 0)
+CHECKPOINT = 'popularity:rolled'
+
+
+def add(model, delta, **key):
+    """Add ``delta`` to the ``loans`` of the row identified by ``key``, creating it if need be"""
+    rows = model.objects.filter(**key)
+    if delta < 0:
+        rows.filter(loans__gte=-delta).update(loans=F('loans') + delta)
+        return
+    if rows.update(loans=F('loans') + delta):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(loans=delta, **key)
+    except IntegrityError:
+        # Another transaction created the row first
+        rows.update(loans=F('loans') + delta)
+
+
+def covering(day, today):
+    """Windows whose totals include loans issued on ``day``"""
+    return [window for window in TOTALS if not window or day > today - timedelta(days=window)]
+
+
+def totals_as_of():
+    """Day the window totals were last rolled through"""
+    position = JobCheckpoint.objects.filter(name=CHECKPOINT).values_list('position', flat=True).first()
+    return date.fromordinal(position) if position else timezone.localdate()
+
+
+def record_loan(book_id, day, delta=1):
+    add(BookDailyLoans, delta, book_id=book_id, day=day)
+    # The totals may not have been rolled through today yet; the roll takes
+    # this day out of a window when it drops out, so match its coverage
+    windows = covering(day, totals_as_of())
+    if delta < 0:
+        BookPopularity.objects.filter(book_id=book_id, window__in=windows, loans__gte=-delta).update(loans=F('loans') + delta)
+        return
+    totals = BookPopularity.objects.filter(book_id=book_id, window__in=windows)
+    if totals.update(loans=F('loans') + delta) < len(windows):
+        existing = set(totals.values_list('window', flat=True))
+        for window in windows:
+            if window not in existing:
+                add(BookPopularity, delta, book_id=book_id, window=window)
+
+
+def subtract_day(day, window):
+    """Take the loans issued on ``day`` out of the ``window`` totals"""
+    by_count = defaultdict(list)
+    for book_id, loans in BookDailyLoans.objects.filter(day=day, loans__gt=0).values_list('book_id', 'loans'):
+        by_count[loans].append(book_id)
+    for loans, book_ids in by_count.items():
+        BookPopularity.objects.filter(window=window, book_id__in=book_ids, loans__gte=loans).update(loans=F('loans') - loans)
+
+
+def roll(today=None):
+    """Move the window totals forward to ``today``; returns the number of days moved"""
+    today = today or timezone.localdate()
+    with transaction.atomic():
+        checkpoint, _ = JobCheckpoint.objects.select_for_update().get_or_create(
+            name=CHECKPOINT, defaults={'position': today.toordinal()}
+        )
+        last = date.fromordinal(checkpoint.position)
+        days = (today - last).days
+        if days <= 0:
+            return 0
+        if days > max(TOTALS):
+            # Every window has moved past its old contents
+            rebuild_totals(today)
+        else:
+            for offset in range(1, days + 1):
+                for window in TOTALS:
+                    if window:
+                        subtract_day(last + timedelta(days=offset - window), window)
+            # Books that dropped out of a window no longer need a row in it
+            BookPopularity.objects.filter(window__gt=0, loans=0).delete()
+            JobCheckpoint.objects.filter(pk=checkpoint.pk).update(position=today.toordinal())
+    return days
+
+
+@tasks.task(concurrency=1)
+def roll_popularity(on=None):
+    """Queued form of ``manage.py backfill_popularity --roll``, as of ``on`` (ISO date) or today"""
+    roll(date.fromisoformat(on) if on else None)
+
+
+def rebuild_totals(today, apps=None, using='default'):
+    """Recompute every window total from the daily rows, as of ``today``"""
+    Daily = apps.get_model('library', 'BookDailyLoans') if apps else BookDailyLoans
+    Totals = apps.get_model('library', 'BookPopularity') if apps else BookPopularity
+    Checkpoint = apps.get_model('library', 'JobCheckpoint') if apps else JobCheckpoint
+    with transaction.atomic(using=using):
+        Totals._default_manager.using(using).all().delete()
+        for window in TOTALS:
+            rows = Daily._default_manager.using(using).all()
+            if window:
+                rows = rows.filter(day__gt=today - timedelta(days=window))
+            sums = rows.order_by().values_list('book_id').annotate(total=Sum('loans')).filter(total__gt=0)
+            Totals._default_manager.using(using).bulk_create(
+                (Totals(book_id=book_id, window=window, loans=total) for book_id, total in sums.iterator(chunk_size=5000)),
+                batch_size=5000,
+            )
+        Checkpoint._default_manager.using(using).update_or_create(
+            name=CHECKPOINT, defaults={'position': today.toordinal()}
+        )
+
+
+def rebuild(apps, start=None, stop=None, chunk_days=31, using='default', today=None):
+    """Recompute the daily rows for issue dates in ``[start, stop)``, by default
+    all of them, then every window total.
+
+    ``apps`` may be historical models. Returns the number of daily rows written.
+    """
+    Loan = apps.get_model('library', 'Loan')
+    Daily = apps.get_model('library', 'BookDailyLoans')
+    loans = Loan._default_manager.using(using)
+    bounds = loans.aggregate(first=Min('issue_date'), last=Max('issue_date'))
+    start = start or bounds['first']
+    stop = stop or (bounds['last'] and bounds['last'] + timedelta(days=1))
+
+    written = 0
+    day = start
+    while day and day < stop:
+        chunk_stop = min(day + timedelta(days=chunk_days), stop)
+        counts = (
+            loans.filter(issue_date__gte=day, issue_date__lt=chunk_stop)
+            .order_by()
+            .values_list('book_id', 'issue_date')
+            .annotate(n=Count('pk'))
+        )
+        with transaction.atomic(using=using):
+            Daily._default_manager.using(using).filter(day__gte=day, day__lt=chunk_stop).delete()
+            written += len(Daily._default_manager.using(using).bulk_create(
+                [Daily(book_id=book_id, day=issued, loans=n) for book_id, issued, n in counts],
+                batch_size=5000,
+            ))
+        day = chunk_stop
+    rebuild_totals(today or timezone.localdate(), apps=apps, using=using)
+    return written
+
+
+def rolled(today):
+    return JobCheckpoint.objects.filter(name=CHECKPOINT, position=today.toordinal()).exists()
+
+
+def top_books(days=None, category=None, limit=5, today=None):
+    """The ``limit`` most borrowed books of the last ``days`` days, each with ``loan_count``"""
+    today = today or timezone.localdate()
+    if rolled(today):
+        rows = BookPopularity.objects.filter(window=days or 0)
+        if category is not None:
+            rows = rows.filter(book__category=category)
+        totals = list(rows.order_by('-loans', '-book').values_list('book', 'loans')[:limit])
+    else:
+        rows = BookDailyLoans.objects.all()
+        if days is not None:
+            rows = rows.filter(day__gt=today - timedelta(days=days))
+        if category is not None:
+            rows = rows.filter(book__category=category)
+        totals = list(rows.order_by().values_list('book').annotate(n=Sum('loans')).order_by('-n', '-book')[:limit])
+    books = Book.objects.select_related('author').in_bulk([book_id for book_id, _ in totals])
+    result = []
+    for book_id, loans in totals:
+        book = books.get(book_id)
+        if book is not None and loans:
+            book.loan_count = loans
+            result.append(book)
+    return result
@@ -0,0 +1,78 @@
+"""Due-date reminder emails.
+
+``send_due_reminders`` runs as a task, usually queued each morning with
+``manage.py enqueue_task send_due_reminders``. It emails every member with
+an open loan due within ``LIBRARY_REMINDER_DAYS`` days. A member with
+several such loans gets one email listing all of them.
+
+Loans are read in keyset batches ordered by member. Messages go out
+``LIBRARY_REMINDER_BATCH`` at a time over a single connection to the mail
+server, which is opened once for the whole run. After each batch is sent,
+its loans are stamped with ``reminded_on``. A retried or overlapping run
+therefore skips members who have already been emailed.
+"""
+from datetime import date, timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import tasks
+from .models import Loan
+from .pagination import KeysetPaginator
+
+FIELDS = ('id', 'member', 'member__first_name', 'member__email', 'book__title', 'due_date')
+
+
+def due_loans(today, days):
+    return Loan.objects.filter(
+        return_date__isnull=True,
+        due_date__gte=today,
+        due_date__lte=today + timedelta(days=days),
+        reminded_on__isnull=True,
+    )
+
+
+def loan_rows(queryset, batch_size):
+    for batch in KeysetPaginator(queryset, ('member', 'due_date', 'id'), per_page=batch_size).batches(*FIELDS):
+        yield from batch
+
+
+def reminder(loans):
+    """One EmailMessage covering ``loans``, which all belong to one member"""
+    first = loans[0]
+    body = render_to_string('library/email/due_reminder.txt', {'name': first['member__first_name'], 'loans': loans})
+    count = len(loans)
+    subject = 'A library book is due soon' if count == 1 else f'{count} library books are due soon'
+    return EmailMessage(subject, body, to=[first['member__email']])
+
+
+@tasks.task(concurrency=1)
+def send_due_reminders(days=None, on=None):
+    """Email members whose loans fall due within ``days`` of ``on`` (ISO date, default today)"""
+    today = date.fromisoformat(on) if on else timezone.localdate()
+    days = settings.LIBRARY_REMINDER_DAYS if days is None else days
+    batch_size = settings.LIBRARY_REMINDER_BATCH
+    rows = loan_rows(due_loans(today, days), batch_size)
+
+    sent = 0
+    messages, loan_ids = [], []
+    with get_connection() as connection:
+        for _, group in groupby(rows, key=lambda row: row['member']):
+            loans = list(group)
+            messages.append(reminder(loans))
+            loan_ids.extend(row['id'] for row in loans)
+            if len(messages) >= batch_size:
+                sent += send_batch(connection, messages, loan_ids, today)
+                messages, loan_ids = [], []
+        if messages:
+            sent += send_batch(connection, messages, loan_ids, today)
+    return sent
+
+
+def send_batch(connection, messages, loan_ids, today):
+    sent = connection.send_messages(messages)
+    Loan.objects.filter(pk__in=loan_ids).update(reminded_on=today)
+    return sent
@@ -0,0 +1,124 @@
+"""Sending the read-only pages to read replicas.
+
+Views marked with ``replica_reads`` read from one of the aliases in
+``LIBRARY_READ_REPLICAS`` when they are requested with GET or HEAD. Every
+other view, and every write, uses ``default``. Within one request:
+
+- all replica reads go to the same replica, so the page shows a single snapshot;
+- once the request writes, or while ``default`` is inside a transaction,
+  reads go back to ``default`` so the request sees its own writes.
+
+Replicas lag behind the primary, so a browser that has just written (for
+example, ``book_add`` redirecting to the book list) keeps reading from
+``default`` for ``LIBRARY_REPLICA_STICKY_SECONDS``. ``ReplicaRoutingMiddleware``
+handles this with a cookie.
+
+Reads whose results are shared beyond the request, such as the dashboard's
+cached statistics, go to ``default`` inside ``primary_reads()``.
+
+A replica that cannot be reached is skipped for
+``LIBRARY_REPLICA_RETRY_SECONDS`` and its reads fall back to ``default``.
+Stale persistent connections are handled by Django's ``CONN_HEALTH_CHECKS``.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+STICKY_COOKIE = 'library_primary'
+
+# Routing state of the request being served in the current thread or task
+current = ContextVar('library_db_routing', default=None)
+
+# alias -> time.monotonic() after which it is worth trying again
+down = {}
+down_lock = threading.Lock()
+
+
+class RequestRouting:
+    __slots__ = ('replica', 'wrote')
+
+    def __init__(self, replica=None):
+        # Alias this request reads from, or None to read from the primary
+        self.replica = replica
+        self.wrote = False
+
+
+def replica_reads(view):
+    """Let ``view`` read from a replica; mark it outside other decorators"""
+    view.replica_reads = True
+    return view
+
+
+@contextmanager
+def primary_reads():
+    """Read from ``default`` inside the block, even in a ``replica_reads`` view.
+
+    For values that outlive the request, such as entries in a shared cache,
+    which must not capture a lagging replica.
+    """
+    token = current.set(None)
+    try:
+        yield
+    finally:
+        current.reset(token)
+
+
+def replicas():
+    return getattr(settings, 'LIBRARY_READ_REPLICAS', [])
+
+
+def reachable(alias):
+    with down_lock:
+        if down.get(alias, 0) > time.monotonic():
+            return False
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError:
+        retry = getattr(settings, 'LIBRARY_REPLICA_RETRY_SECONDS', 30)
+        with down_lock:
+            down[alias] = time.monotonic() + retry
+        return False
+    return True
+
+
+def pick_replica():
+    """A reachable replica alias, or None if there is none"""
+    candidates = list(replicas())
+    random.shuffle(candidates)
+    for alias in candidates:
+        if reachable(alias):
+            return alias
+    return None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = current.get()
+        if routing is None or routing.replica is None:
+            return None
+        if routing.wrote or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = current.get()
+        if routing is not None:
+            routing.wrote = True
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in replicas():
+            # Objects read from a replica are saved to the primary
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication
+        return False if db in replicas() else None
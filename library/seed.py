@@ -0,0 +1,191 @@
+"""Synthetic catalog, membership and circulation history.
+
+``seed()`` fills the database with a library shaped like a real one, so
+benchmarks and query plans behave as they would in production. A few
+bestsellers and a few heavy readers account for most loans (Zipf-like
+weights), loans are spread over two years, most are returned, and some of
+the open ones are overdue. Rows are inserted with ``bulk_create`` in
+chunks, so two million loans never sit in memory at once. Signals do not
+fire for bulk inserts; the loan counters, search index and popularity
+rollup are rebuilt at the end instead.
+"""
+import random
+from contextlib import contextmanager
+from datetime import date, timedelta
+from io import StringIO
+from itertools import accumulate
+
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection, transaction
+
+from . import autocomplete, fines, fulltext, popularity, stats, versions
+from .models import Author, Book, Category, Fine, Loan, Member
+
+# Sizes at scale=1
+FULL_SIZE = {'books': 100_000, 'members': 50_000, 'loans': 2_000_000}
+
+ISBN_PREFIX = '999'
+EMAIL_DOMAIN = 'seed.example'
+HISTORY_DAYS = 730
+
+WORDS = (
+    'Shadow Winter River Garden Empire Silent Glass Iron Night Stone Broken Hidden '
+    'Golden Last Distant Burning Paper Salt Northern Quiet Wild Crimson Lost Hollow '
+    'Machine Ocean Forest Kingdom Letter Storm Mirror Harbor Lantern Orchard Atlas'
+).split()
+FIRST_NAMES = (
+    'Ada Ben Chloe Dev Elena Farid Grace Hugo Iris Jonas Kemi Liam Maya Noor Oscar '
+    'Priya Quinn Rosa Sami Tara Uma Victor Wen Yusuf Zoe'
+).split()
+LAST_NAMES = (
+    'Abbott Baker Chen Diallo Evans Fischer Garcia Haddad Ito Jensen Kowalski Lopez '
+    'Murphy Nakamura Okafor Patel Rossi Silva Tanaka Umar Varga Walsh Young Zhang'
+).split()
+CATEGORIES = (
+    'Fiction', 'Fantasy', 'Science Fiction', 'Mystery', 'Thriller', 'Romance', 'History',
+    'Biography', 'Science', 'Philosophy', 'Poetry', 'Travel', 'Cooking', 'Art', 'Children',
+    'Young Adult', 'Horror', 'Economics', 'Politics', 'Religion', 'Health', 'Sport',
+    'Music', 'Drama', 'Computing', 'Mathematics', 'Nature', 'Law', 'Education', 'Humour',
+)
+
+
+def sizes(scale=1.0, **overrides):
+    result = {key: max(1, int(value * scale)) for key, value in FULL_SIZE.items()}
+    result.update((key, value) for key, value in overrides.items() if value is not None)
+    return result
+
+
+def zipf_weights(n, exponent=0.9):
+    """Cumulative weights where item i is picked in proportion to 1 / (i + 1) ** exponent"""
+    return list(accumulate(1 / (i + 1) ** exponent for i in range(n)))
+
+
+@contextmanager
+def explicit_issue_dates():
+    # Loan.issue_date is auto_now_add, which would stamp every seeded loan with today
+    field = Loan._meta.get_field('issue_date')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def seed(books, members, loans, rng=None, today=None, chunk_size=10_000, log=None):
+    """Insert ``books`` books, ``members`` members and ``loans`` loans.
+
+    Returns the number of rows created per model.
+    """
+    rng = rng or random.Random(0)
+    today = today or date.today()
+    log = log or (lambda message: None)
+    counts = {}
+
+    with transaction.atomic():
+        Category.objects.bulk_create([Category(name=name) for name in CATEGORIES])
+        category_ids = list(Category.objects.filter(name__in=CATEGORIES).values_list('pk', flat=True))
+        n_authors = max(1, books // 10)
+        Author.objects.bulk_create(
+            [Author(name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}') for i in range(n_authors)],
+            batch_size=chunk_size,
+        )
+        author_ids = list(Author.objects.order_by('-pk').values_list('pk', flat=True)[:n_authors])
+        counts['authors'] = n_authors
+    log(f'{n_authors} authors')
+
+    copies = [rng.choice((1, 1, 2, 2, 3, 5)) for _ in range(books)]
+    for start in range(0, books, chunk_size):
+        with transaction.atomic():
+            Book.objects.bulk_create([
+                Book(
+                    title=' '.join(rng.sample(WORDS, rng.randint(2, 4))),
+                    slug=f'seed-book-{i}',
+                    author_id=rng.choice(author_ids),
+                    isbn=f'{ISBN_PREFIX}{i:010d}',
+                    publisher=rng.choice(LAST_NAMES) + ' Press',
+                    published_date=date(1950, 1, 1) + timedelta(days=rng.randrange(365 * 75)),
+                    total_copies=copies[i],
+                    available_copies=copies[i],
+                )
+                for i in range(start, min(start + chunk_size, books))
+            ])
+    book_ids = list(Book.objects.filter(isbn__startswith=ISBN_PREFIX).order_by('isbn').values_list('pk', flat=True))
+    Through = Book.category.through
+    for ids in chunked(book_ids, chunk_size):
+        Through.objects.bulk_create([
+            Through(book_id=book_id, category_id=category_id)
+            for book_id in ids
+            for category_id in rng.sample(category_ids, rng.randint(1, 3))
+        ])
+    counts['books'] = books
+    log(f'{books} books')
+
+    for start in range(0, members, chunk_size):
+        Member.objects.bulk_create([
+            Member(
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                email=f'member{i}@{EMAIL_DOMAIN}',
+            )
+            for i in range(start, min(start + chunk_size, members))
+        ])
+    member_ids = list(Member.objects.filter(email__endswith='@' + EMAIL_DOMAIN).order_by('pk').values_list('pk', flat=True))
+    counts['members'] = members
+    log(f'{members} members')
+
+    # Popular books and heavy readers get most of the loans
+    book_weights = zipf_weights(len(book_ids))
+    member_weights = zipf_weights(len(member_ids), exponent=0.6)
+    on_loan = [0] * len(book_ids)
+    created = fined = 0
+    with explicit_issue_dates():
+        while created < loans:
+            batch, late = [], []
+            size = min(chunk_size, loans - created)
+            picks = rng.choices(range(len(book_ids)), cum_weights=book_weights, k=size)
+            readers = rng.choices(member_ids, cum_weights=member_weights, k=size)
+            for book, member_id in zip(picks, readers):
+                issued = today - timedelta(days=rng.randrange(HISTORY_DAYS))
+                due = issued + timedelta(days=14)
+                returned = min(issued + timedelta(days=rng.randint(1, 30)), today)
+                # Roughly one loan in ten from the last month is still out, if a copy is free
+                if (today - issued).days < 30 and rng.random() < 0.1 and on_loan[book] < copies[book]:
+                    on_loan[book] += 1
+                    returned = None
+                loan = Loan(book_id=book_ids[book], member_id=member_id, issue_date=issued, due_date=due, return_date=returned)
+                batch.append(loan)
+                if returned and returned > due:
+                    late.append(loan)
+            with transaction.atomic():
+                Loan.objects.bulk_create(batch)
+                if late and late[0].pk is None:
+                    # MySQL does not hand back primary keys from bulk inserts
+                    late = []
+                Fine.objects.bulk_create([
+                    Fine(loan_id=loan.pk, member_id=loan.member_id, amount=fines.fine_amount(loan.due_date, loan.return_date), paid=rng.random() < 0.9)
+                    for loan in late
+                ])
+            created += size
+            fined += len(late)
+            log(f'{created} loans')
+    counts['loans'] = created
+    counts['fines'] = fined
+
+    for book, out in enumerate(on_loan):
+        if out:
+            Book.objects.filter(pk=book_ids[book]).update(available_copies=copies[book] - out)
+
+    # bulk_create bypasses the signals that maintain these
+    call_command('rebuild_loan_counters', chunk_size=chunk_size, stdout=StringIO())
+    fulltext.rebuild(apps, using=connection.alias)
+    popularity.rebuild(apps, using=connection.alias)
+    stats.get_cache().clear()
+    versions.bump('book', 'author', 'category', 'member')
+    autocomplete.index.clear()
+    return counts
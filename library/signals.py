@@ -0,0 +1,176 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import autocomplete, fines, fulltext, metrics, popularity, stats, versions
+from .models import Author, Book, Category, Fine, Hold, Loan, Member
+
+
+# Search index sync
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Member)
+def index_saved_object(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    fulltext.index_instances(sender, [instance])
+
+
+@receiver(post_save, sender=Author)
+def index_saved_author(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    fulltext.index_instances(Author, [instance])
+    # Book documents embed the author's name
+    fulltext.index_objects(Book, instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Member)
+def unindex_deleted_object(sender, instance, **kwargs):
+    fulltext.remove_objects(sender, [instance.pk])
+
+
+# Autocomplete index of this process, once the write has committed
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+def update_autocomplete(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(partial(autocomplete.index.put, instance))
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+def remove_from_autocomplete(sender, instance, **kwargs):
+    transaction.on_commit(partial(autocomplete.index.remove, sender._meta.model_name, instance.pk))
+
+
+# Member loan counters
+def adjust_loan_counts(member_id, active=0, total=0):
+    if active or total:
+        Member.objects.filter(pk=member_id).update(
+            active_loan_count=F('active_loan_count') + active,
+            total_loan_count=F('total_loan_count') + total,
+        )
+
+
+@receiver(post_save, sender=Loan)
+def count_saved_loan(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    is_open = instance.return_date is None
+    if created:
+        adjust_loan_counts(instance.member_id, active=int(is_open), total=1)
+    elif hasattr(instance, '_loaded_return_date'):
+        was_open = instance._loaded_return_date is None
+        adjust_loan_counts(instance.member_id, active=int(is_open) - int(was_open))
+    instance._loaded_return_date = instance.return_date
+
+
+@receiver(post_delete, sender=Loan)
+def count_deleted_loan(sender, instance, **kwargs):
+    adjust_loan_counts(instance.member_id, active=-int(instance.return_date is None), total=-1)
+
+
+# Daily loan counts behind the popular books lists
+@receiver(post_save, sender=Loan)
+def count_issued_loan(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        popularity.record_loan(instance.book_id, instance.issue_date)
+
+
+@receiver(post_delete, sender=Loan)
+def uncount_deleted_loan(sender, instance, **kwargs):
+    popularity.record_loan(instance.book_id, instance.issue_date, delta=-1)
+
+
+# Member fine balances; bulk writers in library.fines refresh them directly
+@receiver(post_save, sender=Fine)
+@receiver(post_delete, sender=Fine)
+def refresh_fine_balance(sender, instance, raw=False, **kwargs):
+    if not raw:
+        fines.refresh_balances(Member.objects.filter(pk=instance.member_id))
+
+
+# Dashboard statistics cache, touched only once the write has committed
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Member)
+def refresh_stats_on_save(sender, instance, created, raw=False, **kwargs):
+    key = 'total_books' if sender is Book else 'total_members'
+    if created:
+        transaction.on_commit(partial(stats.adjust, key, 1))
+    else:
+        # Titles and names are shown in the activity lists
+        transaction.on_commit(partial(stats.invalidate, 'activity'))
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Member)
+def refresh_stats_on_delete(sender, instance, **kwargs):
+    key = 'total_books' if sender is Book else 'total_members'
+    transaction.on_commit(partial(stats.adjust, key, -1))
+    transaction.on_commit(partial(stats.invalidate, 'activity'))
+
+
+@receiver(post_save, sender=Loan)
+@receiver(post_delete, sender=Loan)
+def refresh_stats_on_loan_change(sender, instance, **kwargs):
+    transaction.on_commit(stats.invalidate_loans)
+
+
+# Version counters behind the ETag/Last-Modified headers
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def bump_book_version(sender, instance, raw=False, **kwargs):
+    if not raw:
+        versions.bump_on_commit('book', 'book:%s' % instance.pk)
+
+
+@receiver(m2m_changed, sender=Book.category.through)
+def bump_book_categories_version(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        keys = ['book:%s' % pk for pk in pk_set or ()]
+    else:
+        keys = ['book:%s' % instance.pk]
+    versions.bump_on_commit('book', 'category', *keys)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Member)
+@receiver(post_delete, sender=Member)
+def bump_model_version(sender, instance, raw=False, **kwargs):
+    if not raw:
+        versions.bump_on_commit(sender._meta.model_name)
+
+
+@receiver(post_save, sender=Loan)
+@receiver(post_delete, sender=Loan)
+def bump_loan_version(sender, instance, raw=False, **kwargs):
+    # Issuing and returning change the book's available copies
+    if not raw:
+        versions.bump_on_commit('circulation', 'book:%s' % instance.book_id)
+
+
+@receiver(post_save, sender=Hold)
+@receiver(post_delete, sender=Hold)
+def bump_hold_version(sender, instance, raw=False, **kwargs):
+    # The book page shows its hold queue, and a copy readied for a hold or
+    # passed on from one changes the available copies the listings show
+    if not raw:
+        versions.bump_on_commit('circulation', 'book:%s' % instance.book_id)
+
+
+# Request metrics, see library/middleware.py
+@receiver(connection_created)
+def install_sql_metrics(sender, connection, **kwargs):
+    if metrics.sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.sql_wrapper)
@@ -0,0 +1,64 @@
+import re
+
+from django.db.models import IntegerField, Max
+from django.db.models.functions import Cast, Substr
+from django.utils.text import slugify
+
+from .models import Book
+
+# Leave room for a "-<n>" suffix inside SlugField's 50 characters
+MAX_BASE_LENGTH = 40
+
+SUFFIXED = re.compile(r'(.+)-([0-9]+)')
+
+
+def base_slug(title):
+    return slugify(title)[:MAX_BASE_LENGTH].strip('-') or 'book'
+
+
+class SlugAllocator:
+    """Unique Book slugs for a stream of titles, such as a catalog import.
+
+    Each call costs one query for the exact bases it is given. A base that
+    collides is numbered from a counter kept for the life of the
+    allocator. The counter is seeded by one ``Max`` over the base's
+    existing ``<base>-<n>`` slugs the first time the base collides, so the
+    sibling slugs themselves are never read.
+    """
+
+    def __init__(self):
+        self.counters = {}  # base -> highest "-<n>" suffix in use
+
+    def highest_suffix(self, base):
+        siblings = Book.objects.filter(slug__startswith=base + '-', slug__regex=r'^%s-[0-9]+$' % base)
+        suffix = Cast(Substr('slug', len(base) + 2), IntegerField())
+        return siblings.aggregate(n=Max(suffix))['n'] or 0
+
+    def allocate(self, titles):
+        """Return a unique slug for each title, in order"""
+        bases = [base_slug(title) for title in titles]
+        if not bases:
+            return []
+        taken = set(Book.objects.filter(slug__in=set(bases)).values_list('slug', flat=True))
+
+        slugs = []
+        issued = set()
+        for base in bases:
+            slug = base
+            while slug in taken or slug in issued:
+                if base not in self.counters:
+                    self.counters[base] = self.highest_suffix(base)
+                self.counters[base] += 1
+                slug = f'{base}-{self.counters[base]}'
+            # A title that itself ends in a number uses up that suffix of its prefix
+            match = SUFFIXED.fullmatch(slug)
+            if match and match[1] in self.counters:
+                self.counters[match[1]] = max(self.counters[match[1]], int(match[2]))
+            issued.add(slug)
+            slugs.append(slug)
+        return slugs
+
+
+def allocate_slugs(titles):
+    """Return a unique Book slug for each title, in order"""
+    return SlugAllocator().allocate(titles)
@@ -0,0 +1,158 @@
+"""Cached dashboard statistics.
+
+Every aggregate the dashboard shows is kept under its own key in the
+Django cache (``settings.LIBRARY_STATS_CACHE``), so a render is one
+``get_many`` when the cache is warm. Signal handlers in ``library.signals``
+keep the entries fresh: book and member counts are adjusted in place with
+``incr``/``decr``, and anything derived from loans is simply dropped and
+recomputed on the next render. Every process shares the entries, so they
+are always computed on the primary, never on a lagging replica.
+"""
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from . import concurrency, popularity, routers, tasks
+from .models import Book, Loan, Member
+
+KEY_PREFIX = 'library:stats:'
+TIMEOUT = 300
+
+
+def get_cache():
+    return caches[getattr(settings, 'LIBRARY_STATS_CACHE', 'default')]
+
+
+def overdue_key(today=None):
+    # Loans become overdue at midnight without any write, so the key rolls daily
+    return 'overdue_loans:%s' % (today or timezone.localdate()).isoformat()
+
+
+def compute_total_books(today):
+    return Book.objects.count()
+
+
+def compute_total_members(today):
+    return Member.objects.count()
+
+
+def compute_active_loans(today):
+    return Loan.objects.filter(return_date__isnull=True).count()
+
+
+def compute_overdue_loans(today):
+    return Loan.objects.filter(return_date__isnull=True, due_date__lt=today).count()
+
+
+def compute_recent_loans(today):
+    return list(Loan.objects.select_related('book', 'member').order_by('-issue_date')[:5])
+
+
+def compute_recent_returns(today):
+    return list(Loan.objects.filter(return_date__isnull=False).select_related('book', 'member').order_by('-return_date')[:5])
+
+
+# Days of loans behind the dashboard's popular books
+POPULAR_DAYS = 30
+
+
+def compute_popular_books(today):
+    return popularity.top_books(POPULAR_DAYS, today=today)
+
+
+# The parts of the cached 'activity' entry
+ACTIVITY = {
+    'recent_loans': compute_recent_loans,
+    'recent_returns': compute_recent_returns,
+    'popular_books': compute_popular_books,
+}
+
+
+def compute_activity(today):
+    return {name: compute(today) for name, compute in ACTIVITY.items()}
+
+
+def dashboard_keys(today):
+    return {
+        'total_books': compute_total_books,
+        'total_members': compute_total_members,
+        'active_loans': compute_active_loans,
+        overdue_key(today): compute_overdue_loans,
+        'activity': compute_activity,
+    }
+
+
+def assemble(values, today):
+    stats = dict(values.pop('activity'))
+    stats['overdue_loans'] = values.pop(overdue_key(today))
+    stats.update(values)
+    return stats
+
+
+def get_dashboard_stats():
+    """Return the dashboard context, computing only what the cache lacks"""
+    cache = get_cache()
+    today = timezone.localdate()
+    keys = dashboard_keys(today)
+    cached = cache.get_many([KEY_PREFIX + key for key in keys])
+
+    values, missing = {}, {}
+    with routers.primary_reads():
+        for key, compute in keys.items():
+            if KEY_PREFIX + key in cached:
+                values[key] = cached[KEY_PREFIX + key]
+            else:
+                values[key] = missing[KEY_PREFIX + key] = compute(today)
+    if missing:
+        cache.set_many(missing, TIMEOUT)
+    return assemble(values, today)
+
+
+async def aget_dashboard_stats():
+    """``get_dashboard_stats`` with the missing aggregates queried concurrently"""
+    cache = get_cache()
+    today = timezone.localdate()
+    keys = dashboard_keys(today)
+    cached = await cache.aget_many([KEY_PREFIX + key for key in keys])
+
+    values = {key: cached[KEY_PREFIX + key] for key in keys if KEY_PREFIX + key in cached}
+    # One task per query: the activity entry is split into its three parts
+    tasks = {key: compute for key, compute in keys.items() if key not in values and key != 'activity'}
+    if 'activity' not in values:
+        tasks.update(('activity:' + name, compute) for name, compute in ACTIVITY.items())
+    if tasks:
+        # The pool threads run in a copy of this context, so they read from default too
+        with routers.primary_reads():
+            results = dict(zip(tasks, await concurrency.gather(*(partial(compute, today) for compute in tasks.values()))))
+        missing = {key: value for key, value in results.items() if not key.startswith('activity:')}
+        if 'activity' not in values:
+            missing['activity'] = {name: results['activity:' + name] for name in ACTIVITY}
+        values.update(missing)
+        await cache.aset_many({KEY_PREFIX + key: value for key, value in missing.items()}, TIMEOUT)
+    return assemble(values, today)
+
+
+def adjust(key, delta):
+    """Shift a cached counter in place; a missing entry is left to be recomputed"""
+    cache = get_cache()
+    try:
+        cache.incr(KEY_PREFIX + key, delta)
+    except ValueError:
+        pass
+
+
+def invalidate(*keys):
+    get_cache().delete_many([KEY_PREFIX + key for key in keys])
+
+
+def invalidate_loans():
+    invalidate('active_loans', overdue_key(), 'activity')
+
+
+@tasks.task(concurrency=1)
+def refresh_dashboard():
+    """Recompute every dashboard aggregate, so no request has to"""
+    invalidate(*dashboard_keys(timezone.localdate()))
+    get_dashboard_stats()
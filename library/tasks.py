@@ -0,0 +1,128 @@
+"""Database-backed queue for work that should not hold up a request.
+
+Register a function with ``task`` and queue a call with ``enqueue``::
+
+    @tasks.task(max_attempts=5, concurrency=1)
+    def send_due_reminders(days=None):
+        ...
+
+    tasks.enqueue('send_due_reminders', days=1)
+
+Each call is a ``Task`` row holding its keyword arguments as JSON. Queued
+inside a transaction, it becomes visible to workers only when that
+transaction commits. ``manage.py run_tasks`` claims due tasks and runs
+them in a thread or process pool.
+
+- Claiming is serialized on a ``JobCheckpoint`` row lock, so several
+  workers can share the queue without running a task twice or exceeding a
+  task's ``concurrency`` limit.
+- A claimed task holds a lease of ``LIBRARY_TASK_LEASE_SECONDS``. If its
+  worker dies, the task is queued again once the lease runs out, or marked
+  failed if that was its last attempt.
+- A task that raises is retried after ``retry_delay`` seconds, doubling
+  with each attempt, until ``max_attempts`` is reached. It is then marked
+  failed with the traceback kept in ``error``.
+
+Tasks should be safe to run twice: a worker can die after the work is done
+but before the task is marked done.
+"""
+import traceback
+from collections import Counter, defaultdict, namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import JobCheckpoint, Task
+
+Registered = namedtuple('Registered', 'func max_attempts retry_delay concurrency')
+
+REGISTRY = {}
+CLAIM_LOCK = 'tasks:claim'
+
+
+def task(name=None, max_attempts=3, retry_delay=60, concurrency=None):
+    """Register the decorated function as a task, under its own name by default"""
+    def register(func):
+        func.task_name = name or func.__name__
+        REGISTRY[func.task_name] = Registered(func, max_attempts, retry_delay, concurrency)
+        return func
+    return register
+
+
+def enqueue(name, delay=None, **kwargs):
+    """Queue ``name`` (or a registered function) to run with ``kwargs``, after ``delay`` seconds"""
+    name = getattr(name, 'task_name', name)
+    if name not in REGISTRY:
+        raise LookupError(f'No task named {name!r}.')
+    run_after = timezone.now() + timedelta(seconds=delay or 0)
+    return Task.objects.create(name=name, kwargs=kwargs, run_after=run_after)
+
+
+def requeue_expired(now):
+    """Queue again the tasks whose worker died or overran its lease.
+
+    A task whose lease ran out on its last attempt is marked failed, as if
+    it had raised; returns the number queued again.
+    """
+    lease = timedelta(seconds=settings.LIBRARY_TASK_LEASE_SECONDS)
+    expired = Task.objects.filter(status=Task.RUNNING, claimed_at__lt=now - lease)
+    # Unregistered names could never run again
+    spent = ~Q(name__in=REGISTRY)
+    by_limit = defaultdict(list)
+    for name, entry in REGISTRY.items():
+        by_limit[entry.max_attempts].append(name)
+    for max_attempts, names in by_limit.items():
+        spent |= Q(name__in=names, attempts__gte=max_attempts)
+    expired.filter(spent).update(
+        status=Task.FAILED, finished_at=now, error='Lease expired on the last attempt: the worker died or overran it.',
+    )
+    return expired.update(status=Task.QUEUED)
+
+
+def claim(limit):
+    """Mark up to ``limit`` due tasks running and return their ids"""
+    now = timezone.now()
+    requeue_expired(now)
+    limited = {name: entry.concurrency for name, entry in REGISTRY.items() if entry.concurrency}
+    with transaction.atomic():
+        JobCheckpoint.objects.get_or_create(name=CLAIM_LOCK)
+        JobCheckpoint.objects.select_for_update().get(name=CLAIM_LOCK)
+        running = Counter(dict(
+            Task.objects.filter(status=Task.RUNNING, name__in=limited)
+            .values_list('name').annotate(n=Count('pk')).order_by()
+        ))
+        full = [name for name, cap in limited.items() if running[name] >= cap]
+        due = Task.objects.filter(status=Task.QUEUED, run_after__lte=now).exclude(name__in=full)
+        ids = []
+        for pk, name in due.order_by('run_after', 'id').values_list('pk', 'name')[:limit]:
+            if name in limited:
+                if running[name] >= limited[name]:
+                    continue
+                running[name] += 1
+            ids.append(pk)
+        Task.objects.filter(pk__in=ids).update(status=Task.RUNNING, attempts=F('attempts') + 1, claimed_at=now)
+    return ids
+
+
+def execute(task_id):
+    """Run one claimed task and record the outcome; returns True on success"""
+    task = Task.objects.get(pk=task_id)
+    registered = REGISTRY.get(task.name)
+    try:
+        if registered is None:
+            raise LookupError(f'No task named {task.name!r}.')
+        registered.func(**task.kwargs)
+    except Exception:
+        outcome = {'error': traceback.format_exc()}
+        if registered is not None and task.attempts < registered.max_attempts:
+            delay = registered.retry_delay * 2 ** (task.attempts - 1)
+            outcome.update(status=Task.QUEUED, run_after=timezone.now() + timedelta(seconds=delay))
+        else:
+            outcome.update(status=Task.FAILED, finished_at=timezone.now())
+        Task.objects.filter(pk=task_id).update(**outcome)
+        return False
+    Task.objects.filter(pk=task_id).update(status=Task.DONE, finished_at=timezone.now(), error='')
+    return True
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, exports, lookups, metrics, views
 
 urlpatterns = [
     # Main pages
@@ -11,15 +11,21 @@ urlpatterns = [
     path('books/add/', views.book_add, name='book_add'),
     path('books/<slug:slug>/', views.book_detail, name='book_detail'),
     path('books/<slug:slug>/edit/', views.book_edit, name='book_edit'),
+    path('books/<slug:slug>/hold/', views.hold_place, name='hold_place'),
+    path('holds/<int:pk>/cancel/', views.hold_cancel, name='hold_cancel'),
     
     # Member management
     path('members/', views.member_list, name='member_list'),
     path('members/add/', views.member_add, name='member_add'),
     path('members/<int:pk>/', views.member_detail, name='member_detail'),
+    path('members/<int:pk>/fines/', views.member_fines, name='member_fines'),
+    path('members/<int:pk>/export/', exports.member_history, name='export_member_history'),
     
     # Loan management
     path('loans/', views.loan_list, name='loan_list'),
     path('loans/overdue/', views.overdue_loans, name='overdue_loans'),
+    path('loans/export/', exports.loans, name='export_loans'),
+    path('loans/overdue/export/', exports.overdue_loans, name='export_overdue_loans'),
     path('loans/issue/', views.loan_issue, name='loan_issue'),
     path('loans/return/', views.loan_return, name='loan_return'),
     
@@ -28,7 +34,25 @@ urlpatterns = [
     path('authors/add/', views.author_add, name='author_add'),
     path('authors/<int:pk>/edit/', views.author_edit, name='author_edit'),
     path('categories/', views.category_list, name='category_list'),
+    path('popular/', views.popular_books, name='popular_books'),
     
     # Search
     path('search/', views.search, name='search'),
+    path('search/autocomplete/', views.search_autocomplete, name='search_autocomplete'),
+    path('lookup/<str:kind>/', lookups.lookup, name='lookup'),
+    
+    # JSON API
+    path('api/books/', api.collection, {'resource': 'books'}, name='api_books'),
+    path('api/books/<int:pk>/', api.item, {'resource': 'books'}, name='api_book'),
+    path('api/authors/', api.collection, {'resource': 'authors'}, name='api_authors'),
+    path('api/authors/<int:pk>/', api.item, {'resource': 'authors'}, name='api_author'),
+    path('api/categories/', api.collection, {'resource': 'categories'}, name='api_categories'),
+    path('api/categories/<int:pk>/', api.item, {'resource': 'categories'}, name='api_category'),
+    path('api/members/', api.collection, {'resource': 'members'}, name='api_members'),
+    path('api/members/<int:pk>/', api.item, {'resource': 'members'}, name='api_member'),
+    path('api/loans/', api.collection, {'resource': 'loans'}, name='api_loans'),
+    path('api/loans/<int:pk>/', api.item, {'resource': 'loans'}, name='api_loan'),
+    
+    # Prometheus scrape endpoint
+    path('metrics/', metrics.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,147 @@
+"""Version counters for conditional GET.
+
+Each key names a model (``"book"``) or one object (``"book:42"``) and
+counts the writes that could change what a page shows. Signal handlers in
+``library.signals`` bump the counters once a write commits. Bulk writers
+call ``bump`` themselves. A view decorated with ``conditional`` reads its
+keys in one query and derives a strong ETag and a Last-Modified date from
+them. If the client already has that version, Django answers
+304 Not Modified before the view body runs.
+
+The counters live in the database rather than the cache, so every process
+agrees on them and an evicted entry can never hand out an old ETag again.
+"""
+import hashlib
+import threading
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from .models import ContentVersion
+
+# Keys that name a whole model rather than one object
+MODEL_KEYS = ('author', 'book', 'category', 'circulation', 'member')
+
+# Bumps made by this process, for caches that apply its writes themselves
+local_bumps = Counter()
+local_bumps_lock = threading.Lock()
+
+
+def bump(*keys):
+    now = timezone.now()
+    # A fixed order keeps concurrent bumps from deadlocking on each other's rows
+    for key in sorted(set(keys)):
+        updated = ContentVersion.objects.filter(key=key).update(version=F('version') + 1, updated_at=now)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    ContentVersion.objects.create(key=key, version=1, updated_at=now)
+            except IntegrityError:
+                ContentVersion.objects.filter(key=key).update(version=F('version') + 1, updated_at=now)
+        with local_bumps_lock:
+            local_bumps[key] += 1
+
+
+def bump_on_commit(*keys):
+    transaction.on_commit(lambda: bump(*keys))
+
+
+def bumped_here(keys):
+    """How many times this process has bumped each of ``keys``, in order"""
+    with local_bumps_lock:
+        return tuple(local_bumps[key] for key in keys)
+
+
+def fetch(keys):
+    return {
+        key: (version, updated)
+        for key, version, updated in ContentVersion.objects.filter(key__in=keys).values_list('key', 'version', 'updated_at')
+    }
+
+
+def lookup(keys, request=None):
+    """``(etag source, last modified)`` for ``keys``; unknown keys count as version 0.
+
+    Given a request, counters are read at most once per request. The first
+    read also loads every model-level key, since there are only a few, so a
+    page and all of its cached fragments usually cost a single query.
+    """
+    if request is None:
+        rows = fetch(keys)
+    else:
+        rows = request.__dict__.setdefault('_content_versions', {})
+        missing = set(keys) - rows.keys()
+        if missing:
+            wanted = missing | (set(MODEL_KEYS) - rows.keys())
+            loaded = fetch(wanted)
+            for key in wanted:
+                rows[key] = loaded.get(key, (0, None))
+    state = ';'.join('%s=%s' % (key, rows.get(key, (0,))[0]) for key in sorted(keys))
+    modified = max((rows[key][1] for key in keys if key in rows and rows[key][1]), default=None)
+    return state, modified
+
+
+def conditional(keys_func, forms=False):
+    """``condition`` decorator whose validators come from the version counters.
+
+    ``keys_func(request, *args, **kwargs)`` returns the keys the page
+    depends on. The ETag also covers:
+
+    - the full path, so every query string gets its own ETag;
+    - today's date, because overdue badges change at midnight without a write;
+    - ``LIBRARY_RELEASE``, so a deploy that changes the templates does not
+      keep serving 304s for the old markup.
+
+    Pass ``forms=True`` for pages with POST forms, which embed the visitor's
+    CSRF token. Their ETag also covers the token, they send no
+    Last-Modified (a date cannot tell tokens apart), and they are marked
+    ``Cache-Control: private`` with ``Vary: Cookie`` so shared caches never
+    hand one visitor's token to another.
+    """
+    def versions(request, *args, **kwargs):
+        # condition() asks for the ETag and Last-Modified separately
+        if not hasattr(request, '_content_version_keys'):
+            request._content_version_keys = keys_func(request, *args, **kwargs)
+        return lookup(request._content_version_keys, request)
+
+    def etag(request, *args, **kwargs):
+        # Pending flash messages must be rendered, not skipped by a 304
+        if len(get_messages(request)):
+            return None
+        state, _ = versions(request, *args, **kwargs)
+        release = getattr(settings, 'LIBRARY_RELEASE', '')
+        source = f'{release}|{timezone.localdate()}|{request.get_full_path()}|{state}'
+        if forms:
+            # Set by CsrfViewMiddleware from the cookie (or session) it will check
+            source += '|' + request.META.get('CSRF_COOKIE', '')
+        digest = hashlib.sha1(source.encode()).hexdigest()
+        return '"%s"' % digest[:32]
+
+    def last_modified(request, *args, **kwargs):
+        if len(get_messages(request)):
+            return None
+        modified = versions(request, *args, **kwargs)[1]
+        midnight = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+        return max(modified, midnight) if modified else midnight
+
+    if not forms:
+        return condition(etag_func=etag, last_modified_func=last_modified)
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag)(view)
+
+        @wraps(view)
+        def private_view(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            patch_cache_control(response, private=True)
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return private_view
+    return decorator
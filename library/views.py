@@ -1,64 +1,54 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.contrib import messages
 from django.db.models import Q, Count
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.http import urlencode
+from django.views.decorators.http import require_POST
 from datetime import datetime, timedelta
-from .models import Book, Author, Category, Member, Loan, Fine
-from .forms import BookForm, AuthorForm, CategoryForm
+from . import autocomplete, circulation, concurrency, fines, fulltext, popularity, stats, versions
+from .routers import replica_reads
+from .models import Book, Author, Category, Member, Loan, Fine, Hold
+from .forms import BookForm, AuthorForm, CategoryForm, HoldForm, LoanIssueForm, LoanReturnForm
+from .pagination import paginate
 
 # Dashboard view
 def index(request):
     # return index.html directly
     return render(request, 'library/index.html')
 
-def dashboard(request):
-    # Calculate statistics
-    total_books = Book.objects.count()
-    total_members = Member.objects.count()
-    active_loans = Loan.objects.filter(return_date__isnull=True).count()
-    overdue_loans = Loan.objects.filter(
-        return_date__isnull=True,
-        due_date__lt=timezone.now().date()
-    ).count()
-    
-    # Recent activities
-    recent_loans = Loan.objects.select_related('book', 'member').order_by('-issue_date')[:5]
-    recent_returns = Loan.objects.filter(return_date__isnull=False).select_related('book', 'member').order_by('-return_date')[:5]
-    
-    # Popular books
-    popular_books = Book.objects.annotate(
-        loan_count=Count('loan')
-    ).order_by('-loan_count')[:5]
-    
-    context = {
-        'total_books': total_books,
-        'total_members': total_members,
-        'active_loans': active_loans,
-        'overdue_loans': overdue_loans,
-        'recent_loans': recent_loans,
-        'recent_returns': recent_returns,
-        'popular_books': popular_books,
-    }
-    return render(request, 'library/dashboard.html', context)
+@replica_reads
+async def dashboard(request):
+    # Aggregates are served from the statistics cache, see library/stats.py;
+    # those it lacks are queried concurrently
+    context = await stats.aget_dashboard_stats()
+    context['today'] = timezone.localdate()
+    return await sync_to_async(render)(request, 'library/dashboard.html', context)
 
 # Book views
+def book_detail_versions(request, slug):
+    pk = Book.objects.filter(slug=slug).values_list('pk', flat=True).first()
+    # Loans show member names; the page also shows the author and categories
+    return ['book:%s' % pk, 'author', 'category', 'member']
+
+@replica_reads
+@versions.conditional(lambda request: ['book', 'circulation', 'author', 'category'])
 def book_list(request):
     query = request.GET.get('q')
     category_filter = request.GET.get('category')
     
     books = Book.objects.select_related('author').prefetch_related('category')
     
-    if query:
-        books = books.filter(
-            Q(title__icontains=query) |
-            Q(author__name__icontains=query) |
-            Q(isbn__icontains=query)
-        )
-    
     if category_filter:
         books = books.filter(category__id=category_filter)
     
+    if query:
+        # Best matches first, paged through the whole result set
+        books = fulltext.paginate(request, books, query)
+    else:
+        books = paginate(request, books, ('title', 'id'))
     categories = Category.objects.all()
     
     context = {
@@ -69,16 +59,28 @@ def book_list(request):
     }
     return render(request, 'library/book_list.html', context)
 
+HOLD_QUEUE = 5
+
+@versions.conditional(book_detail_versions, forms=True)
 def book_detail(request, slug):
     book = get_object_or_404(Book, slug=slug)
     active_loans = Loan.objects.filter(book=book, return_date__isnull=True)
     loan_history = Loan.objects.filter(book=book).select_related('member').order_by('-issue_date')[:10]
+    # Both lists are read in queue order from hold_queue_idx; only the head
+    # of the waiting queue is shown
+    holds = Hold.objects.filter(book=book).select_related('member').order_by('-priority', 'id')
+    waiting = holds.filter(status=Hold.WAITING)
     
     context = {
         'book': book,
         'active_loans': active_loans,
         'loan_history': loan_history,
         'is_available': book.available_copies > 0,
+        'ready_holds': holds.filter(status=Hold.READY),
+        'hold_queue': waiting[:HOLD_QUEUE],
+        'waiting_count': waiting.count(),
+        'hold_form': HoldForm(),
+        'today': timezone.localdate(),
     }
     return render(request, 'library/book_detail.html', context)
 
@@ -88,17 +90,11 @@ def member_list(request):
     
     members = Member.objects.all()
     
+    # Loan statistics come from the counters maintained on Member
     if query:
-        members = members.filter(
-            Q(first_name__icontains=query) |
-            Q(last_name__icontains=query) |
-            Q(email__icontains=query)
-        )
-    
-    # Add loan statistics
-    for member in members:
-        member.active_loans = Loan.objects.filter(member=member, return_date__isnull=True).count()
-        member.total_loans = Loan.objects.filter(member=member).count()
+        members = fulltext.paginate(request, members, query)
+    else:
+        members = paginate(request, members, ('last_name', 'first_name', 'id'))
     
     context = {
         'members': members,
@@ -106,42 +102,88 @@ def member_list(request):
     }
     return render(request, 'library/member_list.html', context)
 
-def member_detail(request, pk):
-    member = get_object_or_404(Member, pk=pk)
-    active_loans = Loan.objects.filter(member=member, return_date__isnull=True).select_related('book')
-    loan_history = Loan.objects.filter(member=member).select_related('book').order_by('-issue_date')
-    unpaid_fines = Fine.objects.filter(loan__member=member, paid=False)
+MEMBER_HISTORY = 50
+MEMBER_FINES = 5
+
+async def member_detail(request, pk):
+    # The four queries are independent, so they run concurrently
+    member, active_loans, loan_history, unpaid_fines = await concurrency.gather(
+        lambda: Member.objects.filter(pk=pk).first(),
+        lambda: list(Loan.objects.filter(member_id=pk, return_date__isnull=True).select_related('book')),
+        lambda: list(Loan.objects.filter(member_id=pk).select_related('book').order_by('-issue_date')[:MEMBER_HISTORY]),
+        lambda: list(Fine.objects.filter(member_id=pk, paid=False).select_related('loan__book').order_by('-id')[:MEMBER_FINES]),
+    )
+    if member is None:
+        raise Http404('No Member matches the given query.')
     
+    limit = fines.block_balance()
     context = {
         'member': member,
         'active_loans': active_loans,
         'loan_history': loan_history,
+        # The latest few; the balance covers all of them, see member_fines
         'unpaid_fines': unpaid_fines,
-        'total_unpaid_fines': sum(fine.amount for fine in unpaid_fines),
+        'borrowing_blocked': limit is not None and member.fine_balance > limit,
+        'today': timezone.localdate(),
     }
-    return render(request, 'library/member_detail.html', context)
+    return await sync_to_async(render)(request, 'library/member_detail.html', context)
+
+def member_fines(request, pk):
+    member = get_object_or_404(Member, pk=pk)
+    if request.method == 'POST':
+        # Either the ticked fines or, with "all", every unpaid one
+        if 'all' in request.POST:
+            fine_ids = None
+        else:
+            # Anything but an id cannot name one of the member's fines
+            fine_ids = [value for value in request.POST.getlist('fine') if value.isascii() and value.isdigit()]
+        paid = fines.pay(member, fine_ids)
+        if paid:
+            messages.success(request, f'{paid} fine{"s" if paid != 1 else ""} marked as paid.')
+        else:
+            messages.error(request, 'No unpaid fines were selected.')
+        return redirect('member_fines', pk=member.pk)
+    
+    ledger = paginate(request, Fine.objects.filter(member=member).select_related('loan__book'), ('-id',))
+    context = {
+        'member': member,
+        'fines': ledger,
+    }
+    return render(request, 'library/member_fines.html', context)
 
 # Loan views
 def loan_list(request):
-    loans = Loan.objects.filter(return_date__isnull=True).select_related('book', 'member').order_by('due_date')
+    today = timezone.now().date()
+    active = Loan.objects.filter(return_date__isnull=True)
+    loans = paginate(request, active.select_related('book__author', 'member'), ('due_date', 'id'))
     
     # Mark overdue loans
-    today = timezone.now().date()
+    due_soon = today + timedelta(days=3)
     for loan in loans:
         loan.is_overdue = loan.due_date < today
+        loan.is_due_soon = not loan.is_overdue and loan.due_date <= due_soon
         loan.days_overdue = (today - loan.due_date).days if loan.is_overdue else 0
+        loan.days_left = (loan.due_date - today).days
+    
+    # Summary counts for all active loans, not just the current page
+    stats = active.aggregate(
+        total=Count('id'),
+        overdue=Count('id', filter=Q(due_date__lt=today)),
+        due_soon=Count('id', filter=Q(due_date__gte=today, due_date__lte=due_soon)),
+    )
+    stats['on_time'] = stats['total'] - stats['overdue']
     
     context = {
         'loans': loans,
+        'stats': stats,
     }
     return render(request, 'library/loan_list.html', context)
 
 def overdue_loans(request):
     today = timezone.now().date()
-    loans = Loan.objects.filter(
-        return_date__isnull=True,
-        due_date__lt=today
-    ).select_related('book', 'member').order_by('due_date')
+    overdue = Loan.objects.filter(return_date__isnull=True, due_date__lt=today)
+    # Full lists are downloaded through exports.overdue_loans
+    loans = paginate(request, overdue.select_related('book', 'member'), ('due_date', 'id'))
     
     for loan in loans:
         loan.days_overdue = (today - loan.due_date).days
@@ -152,6 +194,8 @@ def overdue_loans(request):
     return render(request, 'library/overdue_loans.html', context)
 
 # Author and Category views
+@replica_reads
+@versions.conditional(lambda request: ['author', 'book'])
 def author_list(request):
     authors = Author.objects.annotate(book_count=Count('book')).order_by('name')
     
@@ -160,6 +204,8 @@ def author_list(request):
     }
     return render(request, 'library/author_list.html', context)
 
+@replica_reads
+@versions.conditional(lambda request: ['category', 'book'])
 def category_list(request):
     categories = Category.objects.annotate(book_count=Count('book')).order_by('name')
     
@@ -168,30 +214,37 @@ def category_list(request):
     }
     return render(request, 'library/category_list.html', context)
 
+POPULAR_LIMIT = 20
+
+@replica_reads
+@versions.conditional(lambda request: ['circulation', 'book', 'author', 'category'])
+def popular_books(request):
+    window = request.GET.get('window', '30')
+    if window not in popularity.WINDOWS:
+        window = '30'
+    category_id = request.GET.get('category', '')
+    category = Category.objects.filter(pk=category_id).first() if category_id.isdigit() else None
+    
+    context = {
+        'books': popularity.top_books(popularity.WINDOWS[window], category=category, limit=POPULAR_LIMIT),
+        'windows': popularity.WINDOWS,
+        'window': window,
+        'categories': Category.objects.all(),
+        'category': category,
+    }
+    return render(request, 'library/popular_books.html', context)
+
 # Search view
+@replica_reads
 def search(request):
     query = request.GET.get('q')
     results = {}
     
     if query:
-        # Search books
-        results['books'] = Book.objects.filter(
-            Q(title__icontains=query) |
-            Q(author__name__icontains=query) |
-            Q(isbn__icontains=query)
-        ).select_related('author')[:10]
-        
-        # Search members
-        results['members'] = Member.objects.filter(
-            Q(first_name__icontains=query) |
-            Q(last_name__icontains=query) |
-            Q(email__icontains=query)
-        )[:10]
-        
-        # Search authors
-        results['authors'] = Author.objects.filter(
-            name__icontains=query
-        )[:10]
+        # Ranked lookups against the full-text index
+        results['books'] = fulltext.search(Book.objects.select_related('author'), query, limit=10)
+        results['members'] = fulltext.search(Member.objects.all(), query, limit=10)
+        results['authors'] = fulltext.search(Author.objects.all(), query, limit=10)
     
     context = {
         'query': query,
@@ -199,6 +252,19 @@ def search(request):
     }
     return render(request, 'library/search_results.html', context)
 
+AUTOCOMPLETE_LIMIT = 10
+
+def search_autocomplete(request):
+    # Answered from this process's prefix index, without a query
+    query = request.GET.get('q', '')
+    suggestions = autocomplete.index.suggest(query, limit=AUTOCOMPLETE_LIMIT) if query.strip() else []
+    for suggestion in suggestions:
+        if suggestion['kind'] == 'book':
+            suggestion['url'] = reverse('book_detail', args=[suggestion.pop('slug')])
+        else:
+            suggestion['url'] = reverse('search') + '?' + urlencode({'q': suggestion['label']})
+    return JsonResponse({'suggestions': suggestions})
+
 # Form views
 def book_add(request):
     if request.method == 'POST':
@@ -280,7 +346,76 @@ def author_edit(request, pk):
     return render(request, 'library/author_form.html', context)
 
 def loan_issue(request):
-    return render(request, 'library/loan_issue.html')
+    if request.method == 'POST':
+        form = LoanIssueForm(request.POST)
+        if form.is_valid():
+            book = form.cleaned_data['book']
+            member = form.cleaned_data['member']
+            try:
+                loan = circulation.issue_loan(book, member, form.cleaned_data['due_date'])
+            except circulation.CirculationError as e:
+                messages.error(request, str(e))
+            else:
+                messages.success(request, f'"{book.title}" has been issued to {member}, due {loan.due_date:%b %d, %Y}.')
+                return redirect('loan_list')
+        else:
+            messages.error(request, 'Please correct the errors below.')
+    else:
+        form = LoanIssueForm(initial={'member': request.GET.get('member')})
+    
+    context = {
+        'form': form,
+        'default_due_date': circulation.default_due_date(),
+    }
+    return render(request, 'library/loan_issue.html', context)
 
 def loan_return(request):
-    return render(request, 'library/loan_return.html')
+    if request.method == 'POST':
+        form = LoanReturnForm(request.POST)
+        if form.is_valid():
+            try:
+                loan = circulation.return_loan(form.cleaned_data['loan'])
+            except circulation.CirculationError as e:
+                messages.error(request, str(e))
+            else:
+                message = f'"{loan.book.title}" has been returned by {loan.member}.'
+                if loan.held:
+                    message += ' Put it on the hold shelf for the next member in the queue.'
+                messages.success(request, message)
+                return redirect('loan_list')
+        else:
+            messages.error(request, 'Please correct the errors below.')
+    else:
+        form = LoanReturnForm(initial={'loan': request.GET.get('loan')})
+    
+    context = {
+        'form': form,
+    }
+    return render(request, 'library/loan_return.html', context)
+
+@require_POST
+def hold_place(request, slug):
+    book = get_object_or_404(Book, slug=slug)
+    form = HoldForm(request.POST)
+    if form.is_valid():
+        member = form.cleaned_data['member']
+        try:
+            hold = circulation.place_hold(book, member, form.cleaned_data['priority'] or 0)
+        except circulation.CirculationError as e:
+            messages.error(request, str(e))
+        else:
+            messages.success(request, f'{member} has been added to the hold queue for "{book.title}" (hold #{hold.pk}).')
+    else:
+        messages.error(request, ' '.join(error for errors in form.errors.values() for error in errors))
+    return redirect('book_detail', slug=book.slug)
+
+@require_POST
+def hold_cancel(request, pk):
+    hold = get_object_or_404(Hold.objects.select_related('book', 'member'), pk=pk)
+    try:
+        circulation.cancel_hold(hold)
+    except circulation.CirculationError as e:
+        messages.error(request, str(e))
+    else:
+        messages.success(request, f'The hold of {hold.member} on "{hold.book.title}" has been cancelled.')
+    return redirect('book_detail', slug=hold.book.slug)